@@ -13,12 +13,29 @@ import time
 import traceback
 import os
 import platform
+import socket
+import uuid
+import sqlite3
+import tempfile
+import threading
+import weakref
+from email.utils import parsedate_to_datetime
 import redis
+import asyncio
+import aiohttp
 from lxml import html
 import pymysql
 import numpy as np
 import base64
+import random
+import codecs
+import hashlib
+import math
 import requests
+from collections import deque, Counter
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.parse import urlsplit, urlunsplit, unquote_plus
 
 class ConsoleLogger:
     def __init__(self, tag=''):
@@ -45,21 +62,114 @@ class ConsoleLogger:
     __repr__ = __str__
 
 
+class UrlCanonicalizer:
+    """
+    url规范化。写法不同、实际相同的url规范化后是同一个字符串，用于判断重复
+    """
+    TRACKING = ('utm_*', 'gclid', 'fbclid', 'spm')
+    PORTS = {'http': '80', 'https': '443', 'ftp': '21'}
+
+    def __init__(self, strip_fragment:bool=True, sort_query:bool=True, remove_params=TRACKING):
+        """
+        初始化
+        :param strip_fragment: 是否去掉#后面的部分
+        :param sort_query: 是否按参数名排序
+        :param remove_params: 去掉的参数名，比如跟踪参数。以*结尾表示前缀匹配
+        """
+        self.strip_fragment = strip_fragment
+        self.sort_query = sort_query
+        self.remove_names = set(p for p in remove_params if not p.endswith('*'))
+        self.remove_prefixes = tuple(p[:-1] for p in remove_params if p.endswith('*'))
+
+    def __removed(self, param:str)->bool:
+        name = unquote_plus(param.split('=', 1)[0])
+        return name in self.remove_names or (bool(self.remove_prefixes) and name.startswith(self.remove_prefixes))
+
+    def canonicalize(self, url:str)->str:
+        """
+        scheme和host转小写，去掉默认端口、#后面的部分、跟踪参数，参数排序
+        :param url:
+        :return: 规范化后的url
+        """
+        parts = urlsplit(url.strip())
+        scheme = parts.scheme.lower()
+        netloc = parts.netloc
+        userinfo, at, hostport = netloc.rpartition('@')
+        host, colon, port = hostport.rpartition(':') if hostport.rfind(':') > hostport.rfind(']') else (hostport, '', '')
+        if port == self.PORTS.get(scheme):
+            colon, port = '', ''
+        netloc = userinfo + at + host.lower() + colon + port
+        path = parts.path or '/'
+        params = [p for p in parts.query.split('&') if p and not self.__removed(p)]
+        if self.sort_query:
+            params.sort()
+        fragment = '' if self.strip_fragment else parts.fragment
+        return urlunsplit((scheme, netloc, path, '&'.join(params), fragment))
+
+    def __str__(self):
+        return 'UrlCanonicalizer'
+    __repr__ = __str__
+
+
 class MemoryRedup():
     """
     内存判断重复
     """
-    def __init__(self):
+    def __init__(self, canonicalizer:Optional[UrlCanonicalizer]=None, digest_bits:int=0):
+        """
+        初始化
+        :param canonicalizer: url规范化，不填写就使用原始url
+        :param digest_bits: 保存url的摘要而不是url本身，可选值有0、64、128。0表示保存url本身
+        """
+        assert digest_bits in (0, 64, 128), "digest_bits可选值有0、64、128"
+        self.canonicalizer = canonicalizer
+        self.digest_bits = digest_bits
         self.pool = set()
 
+    def key(self, url):
+        """
+        判断重复时实际使用的值：规范化后的url，或者它的摘要
+        :param url:
+        :return: str或者bytes
+        """
+        if self.canonicalizer:
+            url = self.canonicalizer.canonicalize(url)
+        if self.digest_bits:
+            return hashlib.blake2b(url.encode('utf8'), digest_size=self.digest_bits // 8).digest()
+        return url
+
     def loaded(self, url):
-        if url in self.pool:
+        if self.key(url) in self.pool:
             return True
         return False
 
     def load(self, url):
         print(f"新增去重 {url}")
-        self.pool.add(url)
+        self.pool.add(self.key(url))
+
+    def loaded_many(self, urls)->list:
+        """
+        批量判断是否重复
+        :param urls:
+        :return: list，每个url是否重复
+        """
+        return [self.loaded(url) for url in urls]
+
+    def load_many(self, urls)->None:
+        """
+        批量加入
+        :param urls:
+        :return:
+        """
+        for url in urls:
+            self.load(url)
+
+    def flush(self)->None:
+        """
+        把缓存的数据写出去，结束运行时调用
+        :return:
+        """
+        pass
 
     def __str__(self):
         return 'MemoryRedup'
@@ -72,31 +182,567 @@ class RedisRedup(MemoryRedup):
     """
     NAME = 'spider_urls'
 
-    def __init__(self, host:str='127.0.0.1', port:int=6379, db:int=0, password:Optional[str]=None):
+    def __init__(self, host:str='127.0.0.1', port:int=6379, db:int=0, password:Optional[str]=None, name:str=NAME, buffer:int=0, canonicalizer:Optional[UrlCanonicalizer]=None, digest_bits:int=0):
         """
         初始化
         :param host: ip或者hostname
         :param port: 端口号
         :param db: 数据库
         :param password: 密码
+        :param name: 集合名称
+        :param buffer: 本地缓存的url数量，凑够后一次性写入redis。0表示不缓存，立即写入
+        :param canonicalizer: url规范化，不填写就使用原始url
+        :param digest_bits: 保存url的摘要而不是url本身，可选值有0、64、128。0表示保存url本身
         """
+        assert digest_bits in (0, 64, 128), "digest_bits可选值有0、64、128"
+        self.canonicalizer = canonicalizer
+        self.digest_bits = digest_bits
         self.pool = redis.ConnectionPool(host=host, port=port, db=db, password=password)
         self.r = redis.Redis(connection_pool=self.pool)
+        self.name = name
+        self.buffer = buffer
+        self.pending = set()    # 还没写入redis的url
 
-    def loaded(self, url, name=NAME):
-        if self.r.sismember(name, url):
-            return True
-        return False
+    def loaded(self, url, name:Optional[str]=None):
+        return self.loaded_many([url], name=name)[0]
 
-    def load(self, url, name=NAME):
+    def load(self, url, name:Optional[str]=None):
         print("新增去重 {url}".format(url=url))
-        self.r.sadd(RedisRedup.NAME, url)
+        self.load_many([url], name=name)
+
+    def loaded_many(self, urls, name:Optional[str]=None)->list:
+        """
+        批量判断是否重复，一次网络往返
+        :param urls:
+        :param name: 集合名称，不填写就使用初始化时的name
+        :return: list，每个url是否重复
+        """
+        if not urls:
+            return []
+        keys = [self.key(url) for url in urls]
+        name = name or self.name
+        # 本地缓存的只属于初始化时的集合，其他集合只看redis
+        pending = self.pending if name == self.name else ()
+        pipe = self.r.pipeline(transaction=False)
+        for key in keys:
+            pipe.sismember(name, key)
+        return [key in pending or bool(flag) for key, flag in zip(keys, pipe.execute())]
+
+    def load_many(self, urls, name:Optional[str]=None)->None:
+        """
+        批量加入。设置了buffer的话先缓存在本地
+        :param urls:
+        :param name: 集合名称，不填写就使用初始化时的name
+        :return:
+        """
+        if not urls:
+            return
+        keys = [self.key(url) for url in urls]
+        if name and name != self.name:
+            self.r.sadd(name, *keys)
+            return
+        self.pending.update(keys)
+        if len(self.pending) >= self.buffer:
+            self.flush()
+
+    def flush(self)->None:
+        if self.pending:
+            self.r.sadd(self.name, *self.pending)
+            self.pending = set()
 
     def __str__(self):
         return 'RedisRedup'
     __repr__ = __str__
 
 
+def _savez(path: str, data: dict)->None:
+    """
+    保存numpy数组。先写临时文件再替换，保存到一半中断时原来的文件还在
+    :param path:
+    :param data:
+    :return:
+    """
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, **data)
+    os.replace(path + '.tmp', path)
+
+
+class BloomRedup(MemoryRedup):
+    """
+    布隆过滤器判断重复。内存占用远小于MemoryRedup，但是有误判率，会把少量新url误判成重复
+    """
+    def __init__(self, capacity:int=1000000, error_rate:float=0.001, path:Optional[str]=None, canonicalizer:Optional[UrlCanonicalizer]=None):
+        """
+        初始化
+        :param capacity: 预计的url数量，超过后误判率会升高
+        :param error_rate: 误判率
+        :param path: 保存文件的路径。文件存在的话，直接从文件读取；运行结束时flush()自动保存
+        :param canonicalizer: url规范化，不填写就使用原始url
+        """
+        assert capacity > 0, "capacity必须大于0"
+        assert 0 < error_rate < 1, "error_rate必须在0和1之间"
+        self.canonicalizer = canonicalizer
+        self.digest_bits = 0
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.m = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))  # 位数
+        self.k = max(1, int(round(self.m / capacity * math.log(2))))   # 哈希函数个数
+        self.bits = np.zeros((self.m + 7) // 8, dtype=np.uint8)
+        self.count = 0
+        self.path = path
+        if path and os.path.exists(path):
+            with np.load(path) as f:
+                self.restore(f)
+
+    def __indexes(self, keys):
+        """
+        批量计算每个url对应的k个位置。两个64位哈希值组合出k个哈希，一次性向量化计算
+        :param keys: key(...)的结果
+        :return: (字节下标, 位掩码)，形状都是(len(keys), k)
+        """
+        digests = b''.join(hashlib.blake2b(key.encode('utf8'), digest_size=16).digest() for key in keys)
+        h = np.frombuffer(digests, dtype='<u8').reshape(-1, 2)
+        i = np.arange(self.k, dtype=np.uint64)
+        idx = (h[:, :1] + i * h[:, 1:]) % np.uint64(self.m)
+        return (idx >> np.uint64(3)).astype(np.intp), np.left_shift(1, (idx & np.uint64(7)).astype(np.uint8)).astype(np.uint8)
+
+    def loaded_many(self, urls)->list:
+        """
+        批量判断是否重复
+        :param urls:
+        :return: list，每个url是否重复
+        """
+        if not urls:
+            return []
+        byte, mask = self.__indexes([self.key(url) for url in urls])
+        return ((self.bits[byte] & mask) != 0).all(axis=1).tolist()
+
+    def load_many(self, urls)->None:
+        """
+        批量加入。同一批中重复的url只计数一次
+        :param urls:
+        :return:
+        """
+        if not urls:
+            return
+        byte, mask = self.__indexes(list(dict.fromkeys(self.key(url) for url in urls)))
+        self.count += int((~((self.bits[byte] & mask) != 0).all(axis=1)).sum())
+        np.bitwise_or.at(self.bits, byte, mask)
+
+    def loaded(self, url):
+        return self.loaded_many([url])[0]
+
+    def load(self, url):
+        print(f"新增去重 {url}")
+        self.load_many([url])
+
+    def state(self, prefix:str='')->dict:
+        """
+        需要保存的数据
+        :param prefix: 键的前缀
+        :return:
+        """
+        return {prefix + 'meta': np.array([self.capacity, self.m, self.k, self.count], dtype=np.uint64),
+                prefix + 'error_rate': np.array([self.error_rate]),
+                prefix + 'bits': self.bits}
+
+    def restore(self, f, prefix:str='')->None:
+        """
+        从保存的数据还原
+        :param f: np.load(...)的结果
+        :param prefix: 键的前缀
+        :return:
+        """
+        self.capacity, self.m, self.k, self.count = [int(x) for x in f[prefix + 'meta']]
+        self.error_rate = float(f[prefix + 'error_rate'][0])
+        self.bits = f[prefix + 'bits'].copy()
+
+    def dump(self, path:Optional[str]=None)->None:
+        """
+        保存到文件，重启后可以直接读取，不需要重建
+        :param path: 文件路径，不填写就使用初始化时的path
+        :return:
+        """
+        path = path if path else self.path
+        assert path, "需要指定保存的文件路径"
+        _savez(path, self.state())
+
+    def flush(self)->None:
+        """
+        设置了path的话保存到文件
+        :return:
+        """
+        if self.path:
+            self.dump()
+
+    def __str__(self):
+        return 'BloomRedup'
+    __repr__ = __str__
+
+
+class ScalableBloomRedup(MemoryRedup):
+    """
+    可扩展的布隆过滤器。一个过滤器满了，就追加一个容量更大、误判率更低的过滤器，总误判率不超过error_rate
+    """
+    def __init__(self, capacity:int=1000000, error_rate:float=0.001, growth:int=2, ratio:float=0.5, path:Optional[str]=None, canonicalizer:Optional[UrlCanonicalizer]=None):
+        """
+        初始化
+        :param capacity: 第一个过滤器的容量
+        :param error_rate: 总的误判率
+        :param growth: 后一个过滤器的容量是前一个的多少倍
+        :param ratio: 后一个过滤器的误判率是前一个的多少倍
+        :param path: 保存文件的路径。文件存在的话，直接从文件读取；运行结束时flush()自动保存
+        :param canonicalizer: url规范化，不填写就使用原始url
+        """
+        self.canonicalizer = canonicalizer
+        self.digest_bits = 0
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.ratio = ratio
+        self.path = path
+        self.filters = []
+        if path and os.path.exists(path):
+            with np.load(path) as f:
+                for i in range(int(f['size'][0])):
+                    bf = BloomRedup(capacity=1, error_rate=0.5)
+                    bf.restore(f, prefix='{}_'.format(i))
+                    self.filters.append(bf)
+        if not self.filters:
+            self.__grow()
+
+    def __grow(self)->None:
+        i = len(self.filters)
+        self.filters.append(BloomRedup(capacity=self.capacity * self.growth ** i, error_rate=self.error_rate * (1 - self.ratio) * self.ratio ** i))
+
+    def loaded_many(self, urls)->list:
+        urls = [self.key(url) for url in urls]
+        ret = [False] * len(urls)
+        for bf in self.filters:
+            ret = [a or b for a, b in zip(ret, bf.loaded_many(urls))]
+        return ret
+
+    def load_many(self, urls)->None:
+        # 同一批中重复的url只加入一次，不会提前扩展
+        urls = list(dict.fromkeys(self.key(url) for url, flag in zip(urls, self.loaded_many(urls)) if not flag))
+        while urls:
+            bf = self.filters[-1]
+            room = bf.capacity - bf.count
+            if room <= 0:
+                self.__grow()
+                continue
+            bf.load_many(urls[:room])
+            urls = urls[room:]
+
+    def loaded(self, url):
+        return self.loaded_many([url])[0]
+
+    def load(self, url):
+        print(f"新增去重 {url}")
+        self.load_many([url])
+
+    def dump(self, path:Optional[str]=None)->None:
+        """
+        保存到文件，重启后可以直接读取，不需要重建
+        :param path: 文件路径，不填写就使用初始化时的path
+        :return:
+        """
+        path = path if path else self.path
+        assert path, "需要指定保存的文件路径"
+        data = {'size': np.array([len(self.filters)])}
+        for i, bf in enumerate(self.filters):
+            data.update(bf.state(prefix='{}_'.format(i)))
+        _savez(path, data)
+
+    def flush(self)->None:
+        """
+        设置了path的话保存到文件
+        :return:
+        """
+        if self.path:
+            self.dump()
+
+    def __str__(self):
+        return 'ScalableBloomRedup'
+    __repr__ = __str__
+
+
+class MemoryContentRedup:
+    """
+    内存判断内容重复。同一篇文章有多个url（打印版、手机版、带跟踪参数等），url判断不出来，
+    这里计算页面文本的SimHash，汉明距离不超过distance就是重复。
+    64位指纹分成bands段，距离小于bands的两个指纹至少有一段完全相同，只需要比较这一段相同的指纹
+    """
+    TAG_REGEX = re.compile(r'<script.*?</script>|<style.*?</style>|<!--.*?-->|<[^>]+>', re.S | re.I)
+    TOKEN_REGEX = re.compile(r'[\u4e00-\u9fff]|[^\W\u4e00-\u9fff]+')
+
+    def __init__(self, distance:int=3, bands:int=4):
+        """
+        初始化
+        :param distance: 汉明距离不超过这个值就是重复
+        :param bands: 指纹分成的段数，必须大于distance，并且能整除64
+        """
+        assert distance < bands and 64 % bands == 0, "bands必须大于distance，并且能整除64"
+        self.distance = distance
+        self.bands = bands
+        self.width = 64 // bands
+        self.index = [{} for i in range(bands)]  # 每一段的值 -> 指纹列表
+        self.lock = threading.Lock()    # 并发运行时在多个线程中解析，判断和加入要一起完成
+
+    @classmethod
+    def fingerprint(cls, content, encoding: Optional[str] = None)->int:
+        """
+        计算SimHash指纹。去掉标签后分词，相邻两个词组成一个特征
+        :param content: 页面html，str或者bytes
+        :param encoding: content是bytes时的编码
+        :return: 64位整数，没有文本时返回0
+        """
+        if isinstance(content, bytes):
+            content = content.decode(encoding or 'utf8', errors='ignore')
+        tokens = cls.TOKEN_REGEX.findall(cls.TAG_REGEX.sub(' ', content).lower())
+        features = Counter(' '.join(pair) for pair in zip(tokens, tokens[1:])) if len(tokens) > 1 else Counter(tokens)
+        if not features:
+            return 0
+        digests = b''.join(hashlib.blake2b(f.encode('utf8'), digest_size=8).digest() for f in features)
+        h = np.frombuffer(digests, dtype='<u8')
+        bits = (h[:, None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+        weights = np.fromiter(features.values(), dtype=np.int64, count=len(features))
+        v = ((bits.astype(np.int64) * 2 - 1) * weights[:, None]).sum(axis=0)
+        return int(np.left_shift(np.uint64(1), np.arange(64, dtype=np.uint64))[v > 0].sum())
+
+    def split(self, fp:int)->list:
+        """
+        指纹分段
+        :param fp:
+        :return: 每一段的值
+        """
+        mask = (1 << self.width) - 1
+        return [(fp >> (i * self.width)) & mask for i in range(self.bands)]
+
+    def candidates(self, fp:int)->set:
+        """
+        至少有一段相同的指纹
+        :param fp:
+        :return:
+        """
+        ret = set()
+        for i, band in enumerate(self.split(fp)):
+            ret.update(self.index[i].get(band, ()))
+        return ret
+
+    def add(self, fp:int)->None:
+        for i, band in enumerate(self.split(fp)):
+            self.index[i].setdefault(band, []).append(fp)
+
+    def duplicated(self, content, encoding: Optional[str] = None)->bool:
+        """
+        判断内容是否重复，不重复的加入索引
+        :param content: 页面html
+        :param encoding: content是bytes时的编码
+        :return: True表示重复
+        """
+        fp = self.fingerprint(content, encoding)
+        if not fp:
+            return False
+        with self.lock:
+            for other in self.candidates(fp):
+                if bin(fp ^ other).count('1') <= self.distance:
+                    return True
+            self.add(fp)
+        return False
+
+    def __str__(self):
+        return 'MemoryContentRedup'
+    __repr__ = __str__
+
+
+class RedisContentRedup(MemoryContentRedup):
+    """
+    redis判断内容重复。每一段对应一个集合 {name}:{段序号}:{段的值}
+    """
+    NAME = 'spider_contents'
+
+    def __init__(self, host:str='127.0.0.1', port:int=6379, db:int=0, password:Optional[str]=None, name:str=NAME, distance:int=3, bands:int=4):
+        """
+        初始化
+        :param host: ip或者hostname
+        :param port: 端口号
+        :param db: 数据库
+        :param password: 密码
+        :param name: 集合名称的前缀
+        :param distance: 汉明距离不超过这个值就是重复
+        :param bands: 指纹分成的段数，必须大于distance，并且能整除64
+        """
+        super().__init__(distance=distance, bands=bands)
+        self.pool = redis.ConnectionPool(host=host, port=port, db=db, password=password)
+        self.r = redis.Redis(connection_pool=self.pool)
+        self.name = name
+
+    def candidates(self, fp:int)->set:
+        pipe = self.r.pipeline(transaction=False)
+        for i, band in enumerate(self.split(fp)):
+            pipe.smembers('{}:{}:{}'.format(self.name, i, band))
+        return set(int(x) for members in pipe.execute() for x in members)
+
+    def add(self, fp:int)->None:
+        pipe = self.r.pipeline(transaction=False)
+        for i, band in enumerate(self.split(fp)):
+            pipe.sadd('{}:{}:{}'.format(self.name, i, band), fp)
+        pipe.execute()
+
+    def __str__(self):
+        return 'RedisContentRedup'
+    __repr__ = __str__
+
+
+class Broadcast(Sequence):
+    """
+    常量列，只保存一个值，按行数展开
+    """
+    __slots__ = ('value', 'size')
+
+    def __init__(self, value, size: int):
+        self.value = value
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.value] * len(range(*index.indices(self.size)))
+        if not -self.size <= index < self.size:
+            raise IndexError('Broadcast index out of range')
+        return self.value
+
+    def __str__(self):
+        return f'(Broadcast: value={self.value}  size={self.size})'
+    __repr__ = __str__
+
+
+class RecordRow(Sequence):
+    """
+    RecordBatch中的一行，只是视图，不复制数据。可以修改某个字段的值：row[i] = value，见RecordBatch.set(...)
+    """
+    __slots__ = ('batch', 'index')
+
+    def __init__(self, batch, index: int):
+        self.batch = batch
+        self.index = index
+
+    def __len__(self):
+        return len(self.batch.columns)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [column[self.index] for column in self.batch.columns[index]]
+        return self.batch.columns[index][self.index]
+
+    def __setitem__(self, index: int, value):
+        self.batch.set(index, self.index, value)
+
+    def __iter__(self):
+        for column in self.batch.columns:
+            yield column[self.index]
+
+    def __eq__(self, other):
+        return list(self) == list(other) if isinstance(other, (list, tuple, RecordRow)) else NotImplemented
+
+    def __str__(self):
+        return str(list(self))
+    __repr__ = __str__
+
+
+class RecordBatch(Sequence):
+    """
+    按列保存的抓取结果。兼容原来的list嵌套list：第1个是字段名，后面每个都是一行数据，行是视图，不复制数据。
+    也可以按列使用：names是字段名，columns是对应的列。常量、pid这样的列使用Broadcast，不按行展开。
+    Hooker.before_save(...)中修改数据：page.matrix[i][j] = value或者set(...)，第一次修改某一列时复制这一列，不影响page.values。
+    不能像list那样增加、删除行，增加字段用add(...)、broadcast(...)
+    """
+    def __init__(self, names: Optional[list] = None, columns: Optional[list] = None, size: int = 0):
+        """
+        初始化
+        :param names: 字段名
+        :param columns: 每个字段的值，长度都是size
+        :param size: 行数
+        """
+        self.names = names if names is not None else []
+        self.columns = columns if columns is not None else []
+        self.size = size
+        self.owned = set()  #已经复制过、可以修改的列
+
+    def add(self, name: str, values) -> None:
+        """
+        增加一列
+        :param name: 字段名
+        :param values: 长度是size的序列，或者Broadcast
+        :return:
+        """
+        assert len(values) == self.size, '{}的数量是{}，应该是{}'.format(name, len(values), self.size)
+        self.names.append(name)
+        self.columns.append(values)
+
+    def broadcast(self, name: str, value) -> None:
+        """
+        增加一个常量列
+        :param name: 字段名
+        :param value: 每一行都是这个值
+        :return:
+        """
+        self.add(name, Broadcast(value, self.size))
+
+    def set(self, name, index: int, value) -> None:
+        """
+        修改一个值。第一次修改某一列时复制成list，Broadcast也展开成list
+        :param name: 字段名，或者第几个字段
+        :param index: 第几行，从0开始，不包括字段名
+        :param value:
+        :return:
+        """
+        i = name if isinstance(name, int) else self.names.index(name)
+        if i < 0:
+            i += len(self.columns)
+        if i not in self.owned:
+            self.columns[i] = list(self.columns[i])
+            self.owned.add(i)
+        self.columns[i][index] = value
+
+    def column(self, name: str):
+        """
+        按字段名取一列
+        :param name:
+        :return:
+        """
+        return self.columns[self.names.index(name)]
+
+    def rows(self):
+        """
+        按行遍历，不包括字段名
+        :return:
+        """
+        for i in range(self.size):
+            yield RecordRow(self, i)
+
+    def __len__(self):
+        return self.size + 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.size + 1))]
+        if index < 0:
+            index += self.size + 1
+        if index == 0:
+            return self.names
+        if not 0 < index <= self.size:
+            raise IndexError('RecordBatch index out of range')
+        return RecordRow(self, index - 1)
+
+    def __str__(self):
+        return f'(RecordBatch: names={self.names}  size={self.size})'
+    __repr__ = __str__
+
+
 class ConsolePipeline:
     """
     结果输出到控制台
@@ -106,6 +752,13 @@ class ConsolePipeline:
         for line in values:
             print(line)
 
+    def close(self) -> None:
+        """
+        运行结束后，写入缓冲区中剩余的数据、释放资源
+        :return:
+        """
+        pass
+
     def __str__(self):
         return 'ConsolePipeline'
     __repr__ = __str__
@@ -170,11 +823,82 @@ class FilePipeline(ConsolePipeline):
     __repr__ = __str__
 
 
+class MySQLPool:
+    """
+    MySQL连接池。取出空闲过久的连接时先ping，断开了就重连
+    """
+    def __init__(self, size: int = 4, check: float = 30.0, **kwargs):
+        """
+        初始化
+        :param size: 最多保留的空闲连接数
+        :param check: 空闲超过这个秒数的连接，取出时检查是否可用
+        :param kwargs: 传给pymysql.connect(...)的参数
+        """
+        self.size = size
+        self.check = check
+        self.kwargs = kwargs
+        self.idle = deque()     # (连接, 放回的时间)
+        self.lock = threading.Lock()
+
+    def connect(self):
+        return pymysql.connect(**self.kwargs)
+
+    def acquire(self):
+        """
+        取出一个可用的连接，没有空闲的就新建
+        :return:
+        """
+        with self.lock:
+            conn, released = self.idle.pop() if self.idle else (None, 0.0)
+        if conn is None:
+            return self.connect()
+        if time.time() - released > self.check:
+            try:
+                conn.ping(reconnect=True)
+            except Exception:
+                self.discard(conn)
+                return self.connect()
+        return conn
+
+    def release(self, conn, broken: bool = False) -> None:
+        """
+        连接放回池中，出错的连接关闭
+        :param conn:
+        :param broken: 是否出错
+        :return:
+        """
+        with self.lock:
+            if not broken and len(self.idle) < self.size:
+                self.idle.append((conn, time.time()))
+                return
+        self.discard(conn)
+
+    @staticmethod
+    def discard(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        with self.lock:
+            idle, self.idle = self.idle, deque()
+        for conn, _ in idle:
+            self.discard(conn)
+
+    def __str__(self):
+        return 'MySQLPool'
+    __repr__ = __str__
+
+
 class MySQLPipeline(ConsolePipeline):
     """
     结果输出到MySQL
     """
-    def __init__(self, host="localhost", user="root", password="admin", database="test", table="data", port=3306, charset='utf8mb4'):
+    TSV_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\0': '\\0'})
+
+    def __init__(self, host="localhost", user="root", password="admin", database="test", table="data", port=3306, charset='utf8mb4', batch: Optional[int] = None, interval: float = 5.0,
+                 bulk: bool = False, spool: Optional[str] = None, pool_size: int = 2):
         """
         初始化
         :param host:    ip或者hostname，不带端口号
@@ -184,40 +908,181 @@ class MySQLPipeline(ConsolePipeline):
         :param table:   表名称，后面也可以修改
         :param port:    端口
         :param charset:     字符集
+        :param batch:   缓冲区中的行数达到这个值就写入数据库。不填写时普通模式是1，每次save(...)都立即写入并提交；批量导入模式是100000。
+        大于1时save(...)返回后数据可能还在缓冲区，写入失败的数据留在缓冲区，下次写入或者close()时重试
+        :param interval:    batch大于1时，距离上次写入超过这个秒数，也写入数据库。后台线程定时检查，没有新的页面时缓冲区中的数据也会写入
+        :param bulk:    批量导入模式，数据先写到本地的tsv文件，再用LOAD DATA LOCAL INFILE导入，适合大量回填。服务器需要开启local_infile
+        :param spool:   批量导入模式下tsv文件的目录，不填写就是临时目录
+        :param pool_size:   连接池的大小
         """
-        self.db = pymysql.connect(host=host, user=user, password=password, database=database, port=port, charset=charset)
-        self.c = self.db.cursor()
+        self.charset = charset
         self.table_name = table
+        if batch is None:
+            batch = 100000 if bulk else 1
+        assert batch > 1 or not bulk, "批量导入模式每个页面导入一次没有意义，batch必须大于1"
+        self.batch = batch
+        self.interval = interval
+        self.bulk = bulk
+        self.spool = spool
+        self.buffer = {}    # (表名, 字段名) -> 多个页面的数据；批量导入模式下是tsv文件
+        self.rows = 0   # 缓冲区中的行数
+        self.last = time.time()     # 上次写入的时间
+        self.lock = threading.RLock()   # save(...)和后台线程的写入不能同时进行
+        self.stopped = threading.Event()
+        self.timer = None   # 定时写入的后台线程
+        self.pool = MySQLPool(size=pool_size, host=host, user=user, password=password, database=database, port=port, charset=charset, local_infile=bulk)
+        self.pool.release(self.pool.acquire())  # 先连接一次，配置错误时立即报错
+        if self.batch > 1:
+            # 只保留弱引用，忘记close()时__del__(...)仍然会执行
+            self.timer = threading.Thread(target=MySQLPipeline.__tick, args=(weakref.ref(self), self.stopped, self.interval), daemon=True)
+            self.timer.start()
+
+    @staticmethod
+    def __tick(ref, stopped, interval: float) -> None:
+        """
+        后台线程定时写入。出错时数据留在缓冲区，下次save(...)或者close()时重试并抛出异常
+        :param ref: MySQLPipeline的弱引用
+        :param stopped: 停止的信号
+        :param interval: 写入间隔
+        :return:
+        """
+        while not stopped.wait(min(interval, 1.0)):
+            pipeline = ref()
+            if pipeline is None:
+                return
+            with pipeline.lock:
+                if pipeline.rows and time.time() - pipeline.last >= interval:
+                    try:
+                        pipeline.flush()
+                    except Exception:
+                        pass
+            del pipeline
 
     def save_one(self, fields, values, table_name: str = ''):
         self.save([fields, values], table_name=table_name)
 
     def save(self, values, table_name: str = '')->None:
         """
-        保存数据。
+        保存数据。先放入缓冲区，行数或者时间到了再一起写入
         :param values: 是list嵌套list，里面的第一个list是字段名，剩余的list都是数据
         :return: 有错抛异常
         """
-        sql = ''
+        with self.lock:
+            self.__save(values, table_name)
+
+    def __save(self, values, table_name: str = '')->None:
         t_name = table_name if table_name else self.table_name
+        key = (t_name, tuple(values[0]))
+        if self.bulk:
+            if key not in self.buffer:
+                self.buffer[key] = tempfile.NamedTemporaryFile('w', encoding='utf8', newline='', suffix='.tsv', dir=self.spool, delete=False)
+            elif self.buffer[key].closed:
+                # 上次导入失败的tsv文件，继续追加
+                self.buffer[key] = open(self.buffer[key].name, 'a', encoding='utf8', newline='')
+            f = self.buffer[key]
+            for row in values[1:]:
+                f.write('\t'.join(self.tsv(v) for v in row))
+                f.write('\n')
+        else:
+            rows = self.buffer.setdefault(key, [])
+            for row in values[1:]:
+                rows.append(tuple(row))
+        self.rows += len(values) - 1
+        if self.rows >= self.batch or time.time() - self.last >= self.interval:
+            self.flush()
+
+    @classmethod
+    def tsv(cls, value) -> str:
+        """
+        转成LOAD DATA默认格式的一个字段：None是\\N，反斜线、tab、换行等需要转义
+        :param value:
+        :return:
+        """
+        if value is None:
+            return '\\N'
+        return str(value).translate(cls.TSV_ESCAPES)
+
+    def flush(self) -> None:
+        """
+        缓冲区中的数据写入数据库，只提交一次。普通模式使用参数化的多行INSERT，批量导入模式使用LOAD DATA LOCAL INFILE
+        :return: 有错抛异常，数据留在缓冲区，下次写入时重试。提交时出错的话可能已经提交了，再次写入可能重复
+        """
+        with self.lock:
+            self.last = time.time()
+            if not self.buffer:
+                return
+            for attempt in range(2):
+                conn = self.pool.acquire()
+                try:
+                    self.write(conn, self.buffer)
+                except pymysql.err.OperationalError as e:
+                    # 2000以上是客户端错误，比如连接断开。还没有提交，换一个连接重试一次
+                    self.pool.release(conn, broken=True)
+                    if attempt or not e.args or e.args[0] < 2000:
+                        raise
+                    continue
+                except Exception:
+                    self.pool.release(conn, broken=True)
+                    raise
+                try:
+                    conn.commit()
+                except Exception:
+                    # 提交时连接断开，不知道服务器是否已经提交，不自动重试
+                    self.pool.release(conn, broken=True)
+                    raise
+                self.pool.release(conn)
+                break
+            # 提交成功后才清空缓冲区
+            if self.bulk:
+                for f in self.buffer.values():
+                    os.remove(f.name)
+            self.buffer, self.rows = {}, 0
+
+    def write(self, conn, buffer: dict) -> None:
+        """
+        在一个事务中写入缓冲区中的数据，由flush()提交
+        :param conn: 连接
+        :param buffer: 缓冲区
+        :return: 有错回滚，抛异常
+        """
         try:
-            fields = ",".join(values[0])
-            for index in range(1, len(values)):
-                # 执行sql语句
-                sql = u"""INSERT INTO {name}({fields}) VALUES ({values})""".format(name=t_name, fields=fields,  values=",".join(['"'+pymysql.escape_string(v)+'"' for v in values[index]]))
-                self.c.execute(sql)
-            # 提交到数据库执行
-            self.db.commit()
+            with conn.cursor() as c:
+                for (t_name, fields), rows in buffer.items():
+                    if self.bulk:
+                        rows.close()
+                        sql = u"""LOAD DATA LOCAL INFILE %s INTO TABLE {name} CHARACTER SET {charset} FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' ({fields})""".format(name=t_name, charset=self.charset, fields=",".join(fields))
+                        c.execute(sql, (rows.name,))
+                    else:
+                        sql = u"""INSERT INTO {name}({fields}) VALUES ({marks})""".format(name=t_name, fields=",".join(fields), marks=",".join(['%s'] * len(fields)))
+                        c.executemany(sql, rows)
         except Exception as e:
             # 如果发生错误则回滚
-            self.db.rollback()
+            try:
+                conn.rollback()
+            except Exception:
+                pass
             raise e
 
+    def __stop(self) -> None:
+        if self.timer is not None:
+            self.stopped.set()
+            if self.timer is not threading.current_thread():
+                self.timer.join()
+            self.timer = None
+
+    def close(self) -> None:
+        self.__stop()
+        self.flush()
+
     def __del__(self):
-        if self.c:
-            self.c.close()
-        if self.db:
-            self.db.close()
+        if not hasattr(self, 'pool'):
+            # 初始化失败，没有数据
+            return
+        try:
+            self.__stop()
+            self.flush()
+        finally:
+            self.pool.close()
 
     def __str__(self):
         return 'MySQLPipeline'
@@ -313,186 +1178,2013 @@ class MemoryScheduler:
     内存调度器
     """
     def __init__(self, maxsize=0):
-        self.q = list()
+        self.q = deque()
+        self.template = None    # 爬虫的根模板，序列化Page时使用
+
+    def put(self, ele)->bool:
+        """
+        插入到尾部
+        :param ele:
+        :return:
+        """
+        self.q.append(ele)
+        return True
+
+    def head(self):
+        """
+        只读取，不删除
+        :return:
+        """
+        return self.q[0] if len(self.q) else None
+
+    def remove_head(self):
+        """
+        删除头部元素，并返回
+        :return:
+        """
+        ele = self.q.popleft()
+        return ele
+
+    def len(self)->int:
+        return len(self.q)
+
+    def claim(self):
+        """
+        领取头部元素，并发运行时使用。领取后不在队列中，处理完成后调用ack(...)
+        :return: 队列为空时返回None
+        """
+        if not self.len():
+            return None
+        ele = self.head()
+        self.remove_head()
+        return ele
+
+    def ack(self, ele)->None:
+        """
+        领取的元素处理完成
+        :param ele:
+        :return:
+        """
+        pass
+
+    def bind(self, template, prefetch: int = 1)->None:
+        """
+        绑定爬虫的根模板，开始运行前调用。
+        Page要序列化保存时，模板只记录在模板链中的层级，读取时再还原成模板对象
+        :param template: 根模板
+        :param prefetch: 同时处理的Page数量，多个进程共用队列时，每次最多领取这么多
+        :return:
+        """
+        self.template = template
+
+    def busy(self)->bool:
+        """
+        其他进程是否还有领取了、没处理完的Page。它们处理完可能产生新的Page，队列空了也要等待
+        :return:
+        """
+        return False
+
+    def encode(self, ele)->str:
+        """
+        Page序列化成json字符串
+        :param ele:
+        :return:
+        """
+        level, t = 0, self.template
+        while t is not None and t is not ele.template:
+            level, t = level + 1, t.child
+        assert t is not None, "Page的模板不在爬虫的模板链中，需要先调用bind(...)"
+        return json.dumps({'parent': ele.parent, 'url': ele.url, 'level': level, 'attempts': ele.attempts, 'parks': ele.parks, 'not_before': ele.not_before}, ensure_ascii=False)
+
+    def decode(self, raw):
+        """
+        json字符串还原成Page
+        :param raw:
+        :return:
+        """
+        d = json.loads(raw)
+        t = self.template
+        for i in range(d['level']):
+            t = t.child
+        page = Page(parent=d['parent'], url=d['url'], template=t)
+        page.attempts = d.get('attempts', 0)
+        page.parks = d.get('parks', 0)
+        page.not_before = d.get('not_before', 0.0)
+        return page
+
+    def park(self, host: str, until: float) -> None:
+        """
+        暂停一个host，until之前尽量不领取这个host的元素。不支持的调度器忽略
+        :param host:
+        :param until: 暂停到的时间
+        :return:
+        """
+        pass
+
+    def close(self)->None:
+        """
+        运行结束后，释放资源
+        :return:
+        """
+        pass
+
+    def __str__(self):
+        return 'MemoryScheduler'
+    __repr__ = __str__
+
+
+class HostScheduler(MemoryScheduler):
+    """
+    按host分队列的内存调度器。每个host一个队列，多个host之间轮询，避免一个大网站饿死其他网站
+    """
+    def __init__(self, maxsize=0):
+        self.template = None
+        self.queues = {}    # host -> deque
+        self.hosts = deque()    # 轮询顺序，队首就是当前的host
+        self.parked = {}    # host -> 暂停到的时间
+        self.size = 0
+
+    @staticmethod
+    def host(ele)->str:
+        return urlsplit(ele.url).netloc.lower()
+
+    def put(self, ele)->bool:
+        """
+        插入到所属host队列的尾部
+        :param ele:
+        :return:
+        """
+        host = self.host(ele)
+        q = self.queues.get(host)
+        if q is None:
+            q = self.queues[host] = deque()
+            self.hosts.append(host)
+        q.append(ele)
+        self.size += 1
+        return True
+
+    def park(self, host: str, until: float) -> None:
+        self.parked[host] = until
+
+    def head(self):
+        """
+        只读取当前host的队首，不删除。当前host暂停的话，轮到下一个没有暂停的host；
+        所有host都暂停时，轮到最早恢复的host，队首的not_before推迟到恢复的时间，由调用方等待
+        :return:
+        """
+        if not self.size:
+            return None
+        if self.parked:
+            now = time.time()
+            for i in range(len(self.hosts)):
+                if self.parked.get(self.hosts[0], 0) <= now:
+                    self.parked.pop(self.hosts[0], None)
+                    break
+                self.hosts.rotate(-1)
+            else:
+                until = min(self.parked[host] for host in self.hosts)
+                while self.parked[self.hosts[0]] != until:
+                    self.hosts.rotate(-1)
+                ele = self.queues[self.hosts[0]][0]
+                ele.not_before = max(ele.not_before, until)
+                return ele
+        return self.queues[self.hosts[0]][0]
+
+    def remove_head(self):
+        """
+        删除当前host的队首元素并返回，然后轮到下一个host
+        :return:
+        """
+        host = self.hosts.popleft()
+        q = self.queues[host]
+        ele = q.popleft()
+        self.size -= 1
+        if q:
+            self.hosts.append(host)
+        else:
+            del self.queues[host]
+        return ele
+
+    def len(self)->int:
+        return self.size
+
+    def stats(self)->dict:
+        """
+        每个host的队列长度
+        :return: dict，host -> 队列长度
+        """
+        return {host: len(q) for host, q in self.queues.items()}
+
+    def __str__(self):
+        return 'HostScheduler'
+    __repr__ = __str__
+
+
+class RedisScheduler(MemoryScheduler):
+    """
+    redis调度器，多个进程、多台机器共用一个待抓取队列。
+    待抓取的Page放在list {name}:pending中。领取时原子地移动到本进程自己的list {name}:processing:{worker}，
+    处理完成后才删除。进程中途挂掉的话，它领取的Page会被其他进程recover()放回pending，不会丢失。
+    """
+    NAME = 'spider_pages'
+
+    def __init__(self, host:str='127.0.0.1', port:int=6379, db:int=0, password:Optional[str]=None, name:str=NAME, batch:int=50, ttl:int=60):
+        """
+        初始化
+        :param host: ip或者hostname
+        :param port: 端口号
+        :param db: 数据库
+        :param password: 密码
+        :param name: 队列名称，多个进程使用同一个名称就共用一个队列
+        :param batch: 新产生的Page凑够batch个再一次性推送。领取的数量由bind(...)的prefetch决定，不会多领取，其他进程也能分到
+        :param ttl: 心跳过期秒数，超过这个时间没有心跳的进程被认为已经挂掉
+        """
+        self.pool = redis.ConnectionPool(host=host, port=port, db=db, password=password)
+        self.r = redis.Redis(connection_pool=self.pool)
+        self.template = None
+        self.name = name
+        self.batch = batch
+        self.ttl = ttl
+        self.worker = '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.pending = '{}:pending'.format(name)
+        self.workers = '{}:workers'.format(name)
+        self.processing = self.__processing(self.worker)
+        self.local = deque()    # 已经领取、还没处理完的(raw, page)
+        self.claimed = {}   # 并发运行时已经领取的，id(page) -> raw
+        self.out = []   # 还没推送到redis的raw
+        self.prefetch = 1   # 每次最多领取的Page数量，bind(...)时设置
+        self.stopped = threading.Event()
+        self.beater = None  # 后台心跳线程
+
+    def __processing(self, worker)->str:
+        return '{}:processing:{}'.format(self.name, worker)
+
+    def __alive(self, worker)->str:
+        return '{}:alive:{}'.format(self.name, worker)
+
+    def __beat(self)->None:
+        """
+        心跳，表示本进程还活着
+        :return:
+        """
+        pipe = self.r.pipeline(transaction=False)
+        pipe.sadd(self.workers, self.worker)
+        pipe.set(self.__alive(self.worker), 1, ex=self.ttl)
+        pipe.execute()
+
+    def __heartbeat(self)->None:
+        """
+        后台线程定时心跳。等待重试、下载很慢的时候，也不会被其他进程当成已经挂掉
+        :return:
+        """
+        while not self.stopped.wait(self.ttl / 3):
+            try:
+                self.__beat()
+            except redis.RedisError:
+                pass
+
+    def bind(self, template, prefetch: int = 1)->None:
+        self.template = template
+        self.prefetch = prefetch
+        self.__beat()
+        if self.beater is None:
+            self.stopped.clear()
+            self.beater = threading.Thread(target=self.__heartbeat, daemon=True)
+            self.beater.start()
+        self.recover()
+
+    def close(self)->None:
+        """
+        停止心跳，推送缓存的Page，领取了没处理完的放回pending，注销本进程
+        :return:
+        """
+        if self.beater is not None:
+            self.stopped.set()
+            self.beater.join()
+            self.beater = None
+        self.flush()
+        while self.r.rpoplpush(self.processing, self.pending) is not None:
+            pass
+        self.local.clear()
+        self.claimed.clear()
+        pipe = self.r.pipeline(transaction=False)
+        pipe.delete(self.__alive(self.worker))
+        pipe.srem(self.workers, self.worker)
+        pipe.execute()
+
+    def recover(self)->int:
+        """
+        把已经挂掉的进程领取的Page放回pending
+        :return: 放回的数量
+        """
+        count = 0
+        for worker in self.r.smembers(self.workers):
+            worker = worker.decode() if isinstance(worker, bytes) else worker
+            if worker == self.worker or self.r.exists(self.__alive(worker)):
+                continue
+            while self.r.rpoplpush(self.__processing(worker), self.pending) is not None:
+                count += 1
+            self.r.srem(self.workers, worker)
+        return count
+
+    def busy(self)->bool:
+        workers = [w.decode() if isinstance(w, bytes) else w for w in self.r.smembers(self.workers)]
+        workers = [w for w in workers if w != self.worker]
+        if not workers:
+            return False
+        pipe = self.r.pipeline(transaction=False)
+        for worker in workers:
+            pipe.exists(self.__alive(worker))
+            pipe.llen(self.__processing(worker))
+        flags = pipe.execute()
+        return any(alive and size for alive, size in zip(flags[::2], flags[1::2]))
+
+    def flush(self)->None:
+        """
+        把缓存的Page一次性推送到redis
+        :return:
+        """
+        if self.out:
+            self.r.lpush(self.pending, *self.out)
+            self.out = []
+
+    def __fetch(self)->None:
+        """
+        批量领取Page，一次网络往返。加上已经领取、正在处理的，不超过prefetch个
+        :return:
+        """
+        pipe = self.r.pipeline(transaction=False)
+        for i in range(max(1, self.prefetch - len(self.claimed))):
+            pipe.rpoplpush(self.pending, self.processing)
+        for raw in pipe.execute():
+            if raw is not None:
+                self.local.append((raw, self.decode(raw)))
+
+    def put(self, ele)->bool:
+        """
+        先缓存在本地，凑够batch个或者当前Page处理完成时再推送
+        :param ele:
+        :return:
+        """
+        self.out.append(self.encode(ele))
+        if len(self.out) >= self.batch:
+            self.flush()
+        return True
+
+    def head(self):
+        """
+        领取并返回当前Page，不删除
+        :return: 没有领取到返回None，可能是被其他进程领走了
+        """
+        if not self.local:
+            self.flush()
+            self.__fetch()
+            if not self.local and self.recover():
+                self.__fetch()
+        return self.local[0][1] if self.local else None
+
+    def remove_head(self):
+        """
+        当前Page处理完成。新产生的Page和确认完成放在同一个事务中提交
+        :return:
+        """
+        raw, ele = self.local.popleft()
+        self.__done(raw)
+        return ele
+
+    def __done(self, raw)->None:
+        pipe = self.r.pipeline(transaction=True)
+        if self.out:
+            pipe.lpush(self.pending, *self.out)
+            self.out = []
+        pipe.lrem(self.processing, 1, raw)
+        pipe.execute()
+
+    def claim(self):
+        """
+        领取头部Page，它仍然留在本进程的processing中，直到ack(...)
+        :return:
+        """
+        if self.head() is None:
+            return None
+        raw, ele = self.local.popleft()
+        self.claimed[id(ele)] = raw
+        return ele
+
+    def ack(self, ele)->None:
+        self.__done(self.claimed.pop(id(ele)))
+
+    def len(self)->int:
+        return len(self.local) + len(self.out) + self.r.llen(self.pending)
+
+    def __str__(self):
+        return 'RedisScheduler'
+    __repr__ = __str__
+
+
+class DiskScheduler(MemoryScheduler):
+    """
+    内存+磁盘调度器。内存中最多保留maxsize个Page，多出来的按顺序写入本地sqlite文件，
+    内存中的取完后再从磁盘读取下一批。抓取规模超过内存时使用。
+    填写了path时，close()把内存中的Page和已经领取、还没ack(...)的Page写回磁盘，重启后不会丢失
+    """
+    def __init__(self, maxsize:int=10000, path:Optional[str]=None, batch:int=1000):
+        """
+        初始化
+        :param maxsize: 内存中最多保留的Page数量
+        :param path: sqlite文件路径。不填写就使用临时文件，结束后删除；填写的话，重启后可以继续抓取文件中的Page
+        :param batch: 每次批量写入磁盘的Page数量
+        """
+        assert maxsize > 0, "maxsize必须大于0"
+        self.template = None
+        self.maxsize = maxsize
+        self.batch = batch
+        self.q = deque()    # 内存中的Page，都比磁盘上的早
+        self.claimed = {}   # 并发运行时已经领取、还没ack的，id(page) -> page
+        self.out = []   # 还没写入磁盘的raw
+        self.temp = path is None
+        if self.temp:
+            fd, path = tempfile.mkstemp(prefix='spiderlib_', suffix='.db')
+            os.close(fd)
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS frontier (id INTEGER PRIMARY KEY AUTOINCREMENT, raw TEXT NOT NULL)')
+        self.db.commit()
+        self.disk = self.db.execute('SELECT COUNT(*) FROM frontier').fetchone()[0]    # 磁盘上的数量
+
+    def __flush(self)->None:
+        if self.out:
+            self.db.executemany('INSERT INTO frontier (raw) VALUES (?)', [(raw,) for raw in self.out])
+            self.db.commit()
+            self.out = []
+
+    def __load(self)->None:
+        """
+        从磁盘读取下一批到内存
+        :return:
+        """
+        self.__flush()
+        rows = self.db.execute('SELECT id, raw FROM frontier ORDER BY id LIMIT ?', (self.maxsize,)).fetchall()
+        if rows:
+            self.db.execute('DELETE FROM frontier WHERE id <= ?', (rows[-1][0],))
+            self.db.commit()
+            self.disk -= len(rows)
+            self.q.extend(self.decode(raw) for _, raw in rows)
+
+    def put(self, ele)->bool:
+        """
+        内存未满并且磁盘上没有Page时放在内存，否则写入磁盘，保持先进先出
+        :param ele:
+        :return:
+        """
+        if len(self.q) < self.maxsize and not self.disk:
+            self.q.append(ele)
+            return True
+        self.out.append(self.encode(ele))
+        self.disk += 1
+        if len(self.out) >= self.batch:
+            self.__flush()
+        return True
+
+    def head(self):
+        if not self.q and self.disk:
+            self.__load()
+        return self.q[0] if self.q else None
+
+    def remove_head(self):
+        if not self.q and self.disk:
+            self.__load()
+        return self.q.popleft()
+
+    def len(self)->int:
+        return len(self.q) + self.disk
+
+    def claim(self):
+        ele = super().claim()
+        if ele is not None:
+            self.claimed[id(ele)] = ele
+        return ele
+
+    def ack(self, ele)->None:
+        self.claimed.pop(id(ele), None)
+
+    def __unload(self)->None:
+        """
+        已经领取的和内存中的Page写回磁盘，排在磁盘上的Page前面
+        :return:
+        """
+        pages = list(self.claimed.values()) + list(self.q)
+        if not pages:
+            return
+        first = self.db.execute('SELECT MIN(id) FROM frontier').fetchone()[0] or 1
+        self.db.executemany('INSERT INTO frontier (id, raw) VALUES (?, ?)', [(first - len(pages) + i, self.encode(page)) for i, page in enumerate(pages)])
+        self.db.commit()
+        self.disk += len(pages)
+        self.claimed.clear()
+        self.q.clear()
+
+    def close(self)->None:
+        """
+        关闭sqlite，临时文件删除，否则没有抓取的Page都写回磁盘
+        :return:
+        """
+        if self.db:
+            if self.temp:
+                self.db.close()
+                os.remove(self.path)
+            else:
+                self.__flush()
+                self.__unload()
+                self.db.close()
+            self.db = None
+
+    def __del__(self):
+        self.close()
+
+    def __str__(self):
+        return 'DiskScheduler'
+    __repr__ = __str__
+
+
+class Hooker:
+    """
+    专门用于hook的类
+    """
+    def before_download(self, page)->None:
+        """
+        下载页面之前
+        :param page:
+        :return:
+        """
+        pass
+
+    def after_download(self, page)->None:
+        """
+        下载页面之后。page.whole_html只在这里可以使用，之后就释放了
+        :param page:
+        :return:
+        """
+        pass
+
+    def before_save(self, page)->None:
+        """
+        保存数据之前。page.matrix是RecordBatch，不再是list嵌套list：可以用page.matrix[i][j] = value修改值，
+        用page.matrix.add(...)、page.matrix.broadcast(...)增加字段，不能append、删除行
+        :param page:
+        :return:
+        """
+        pass
+
+
+class SavePlan:
+    """
+    保存计划，每个模板编译一次：输出的字段顺序、每个字段来自哪个抓取字段、pid的位置、常量的值。
+    保存每个页面时，只需要按计划取出抓取的列
+    """
+    __slots__ = ('names', 'sources', 'pid', 'constants')
+
+    def __init__(self, fields: dict, expresses: dict):
+        """
+        初始化
+        :param fields: 保存的字段名 -> 抓取的字段名，值是pid表示上级页面的url，不是抓取的字段名就是常量
+        :param expresses: 抓取的字段名 -> 表达式
+        """
+        sources, pid, constants = [], None, []
+        for k, v in fields.items():
+            # k是保存用的名字，v是抓取时用的名字
+            if str(v) in expresses:
+                sources.append((k, v))
+            elif "pid" == v:
+                if pid is None:
+                    pid = k
+            else:
+                constants.append((k, str(v)))
+        self.sources = tuple(sources)   # (保存的字段名, 抓取的字段名)
+        self.pid = pid  # pid的字段名，None表示不保存pid
+        self.constants = tuple(constants)   # (保存的字段名, 常量)
+        # 输出的字段顺序：抓取的字段、pid、常量
+        self.names = tuple([k for k, _ in sources] + ([pid] if pid else []) + [k for k, _ in constants])
+
+    def batch(self, values: dict, parent: Optional[str], is_list: bool) -> RecordBatch:
+        """
+        按计划生成要保存的数据
+        :param values: 抓取的值。没有fields时，保存全部抓取的字段
+        :param parent: 上级页面的url
+        :param is_list: True表示列表页，抓取的字段数量必须一致
+        :return:
+        """
+        columns = [(k, values[v]) for k, v in self.sources if v in values] if self.names else list(values.items())
+        v_len = set(len(column) for _, column in columns)
+        if is_list and len(v_len) != 1:
+            raise ValueError('抓取字段的数量不一致 ' + str(v_len))
+        batch = RecordBatch(size=v_len.pop() if v_len else 0)
+        for k, column in columns:
+            batch.add(k, column)
+        if self.pid:
+            batch.broadcast(self.pid, parent)
+        for k, value in self.constants:
+            batch.broadcast(k, value)
+        return batch
+
+    def __str__(self):
+        return f'(SavePlan: names={self.names}  pid={self.pid}  constants={self.constants})'
+    __repr__ = __str__
+
+
+class Template:
+    __slots__ = ('urls', 'expresses', 'next', 'fields_tag', 'fields', 'is_list', 'hooker', 'child', 'xpaths', 'constants', 'until', 'plan')
+
+    def __init__(self, urls:list, expresses:dict, next:str, fields_tag:dict, fields:dict, is_list:bool, hooker: Hooker = Hooker(), until: str = ''):
+        """
+        :param urls:
+        :param expresses: 字段和xpath，xpath在这里编译，不是/开头的是常量
+        :param next:
+        :param fields_tag: 表名，表示每个模板可以保存到不同的表中
+        :param fields:
+        :param is_list: True表示列表页，False表示实体页
+        :param until: xpath，增量解析时，这个元素出现后就停止下载和解析
+        """
+        assert urls, "urls参数不能空"
+        assert isinstance(urls, list), "urls参数不能空，必须是list"
+        assert expresses, "字段表达式不能空，必须是xpath表达式"
+        self.urls = urls
+        self.expresses = expresses
+        self.next = next
+        self.fields_tag = fields_tag
+        self.fields = fields
+        self.is_list = is_list
+        self.hooker = hooker
+        self.child:Template = None  #下一级的模板
+        # 表达式只编译一次，解析每个页面时直接使用。不是/开头的是常量
+        self.xpaths = {}    #字段 -> 编译好的xpath
+        self.constants = {}     #字段 -> 常量
+        for key, value in expresses.items():
+            value = str(value)
+            if value.startswith("/"):
+                self.xpaths[key] = html.etree.XPath(value, smart_strings=False)  # 结果是普通字符串，不引用DOM树
+            else:
+                self.constants[key] = value
+        self.until = html.etree.XPath(until) if until else None
+        self.plan = SavePlan(fields or {}, expresses)    #保存计划
+
+    def __str__(self):
+        return f'(Template:  urls={self.urls}  expresses={self.expresses}  next={self.next}  fields_tag={self.fields_tag}  fields={self.fields} is_list={self.is_list} child={self.child})'
+    __repr__ = __str__
+
+
+class Page:
+    # 页面很多，使用__slots__节省内存，不能再随意增加属性
+    __slots__ = ('parent', 'url', 'template', 'whole_html', 'encoding', 'values', 'matrix', 'skip', 'error', 'attempts', 'parks', 'not_before', 'feeder', 'validator')
+
+    def __init__(self, parent: Optional[str], url: str, template: Template):
+        """
+        初始化方法，很重要。parent是上级页面的url
+        :param parent: 上级页面的url
+        :param url:  本页面的url
+        :param template: 本页面对应的模板
+        """
+        self.parent = parent
+        self.url = url
+        self.template = template
+        self.whole_html = ''    #页面内容，可以是str，也可以是没有解码的bytes
+        self.encoding = None    #whole_html是bytes时的编码
+        self.values: dict = {}    #抓取页面后的值，保存到这里
+        self.matrix = None  #保存前按模板整理好的RecordBatch
+        self.skip = False   #True表示跳过解析和保存，比如内容重复
+        self.error = None   #下载失败的类型，可选值有timeout、connection、5xx、429、circuit
+        self.attempts = 0   #已经失败的次数
+        self.parks = 0  #host熔断时被拒绝的次数，这时没有真正请求，单独计数
+        self.not_before = 0.0   #重试时，这个时间之后才能下载
+        self.feeder = None  #增量解析时，边下载边构建的DOM树
+        self.validator = None   #新的(ETag, Last-Modified, 内容摘要)，保存成功后才写入ValidatorCache
+
+    def release_html(self) -> None:
+        """
+        解析后释放页面内容，页面在调度器中等待保存时不再占用内存
+        :return:
+        """
+        self.whole_html = ''
+        self.encoding = None
+        self.feeder = None
+
+    def release_values(self) -> None:
+        """
+        保存后释放抓取的值，只留下传递给下一级的字段
+        :return:
+        """
+        next = self.template.next
+        self.values = {next: self.values[next]} if next and next in self.values else {}
+        self.matrix = None
+
+    def __str__(self):
+        return f'(Page: parent={self.parent}  url={self.url}  values={self.values}  template={self.template})'
+    __repr__ = __str__
+
+
+class Parser:
+    incremental = False     # 是否增量解析，True时下载器边下载边调用feeder(...)
+
+    def parse(self, page:Page):
+        pass
+
+    def feeder(self, page: Page, encoding: str):
+        """
+        增量解析，支持时返回HtmlFeeder，不支持返回None
+        :param page:
+        :param encoding: 编码
+        :return:
+        """
+        return None
+
+    def close(self) -> None:
+        """
+        运行结束后，释放资源
+        :return:
+        """
+        pass
+
+
+class HtmlFeeder:
+    """
+    增量解析，边下载边构建DOM树。模板设置了until时，until对应的元素出现，前面的字段已经完整，就停止
+    """
+    def __init__(self, encoding: str, until=None):
+        """
+        初始化
+        :param encoding: 编码
+        :param until: 编译好的xpath，None表示解析全部内容
+        """
+        self.parser = html.etree.HTMLPullParser(events=('start',), tag='html', encoding=encoding)
+        self.until = until
+        self.root = None
+        self.done = False   # True表示提前结束，内容不完整
+
+    def feed(self, chunk: bytes) -> bool:
+        """
+        解析一块内容
+        :param chunk:
+        :return: True表示需要的内容已经完整，可以停止下载
+        """
+        self.parser.feed(chunk)
+        if self.root is None:
+            for _, element in self.parser.read_events():
+                self.root = element
+        self.done = self.until is not None and self.root is not None and len(self.until(self.root)) > 0
+        return self.done
+
+    def close(self):
+        """
+        结束解析
+        :return: DOM树
+        """
+        return self.parser.close()
+
+    def __str__(self):
+        return 'HtmlFeeder'
+    __repr__ = __str__
+
+
+class HtmlParser(Parser):
+    def __init__(self, incremental: bool = False):
+        """
+        初始化
+        :param incremental: 是否增量解析。True时边下载边解析，配合模板的until参数可以提前停止，适合很大的页面
+        """
+        self.incremental = incremental
+        self.local = threading.local()   # lxml解析器不能多个线程同时使用，每个线程一份
+
+    def parser(self, encoding: Optional[str]):
+        """
+        指定编码的lxml解析器，bytes直接交给lxml解析，不需要先解码
+        :param encoding:
+        :return: lxml不认识这个编码时返回None
+        """
+        parsers = getattr(self.local, 'parsers', None)
+        if parsers is None:
+            parsers = self.local.parsers = {}   # 编码 -> lxml解析器
+        if encoding not in parsers:
+            try:
+                parsers[encoding] = html.HTMLParser(encoding=encoding)
+            except LookupError:
+                parsers[encoding] = None
+        return parsers[encoding]
+
+    def tree(self, whole_html: Union[str, bytes], encoding: Optional[str]):
+        """
+        构建DOM树
+        :param whole_html: 页面内容
+        :param encoding: whole_html是bytes时的编码
+        :return:
+        """
+        if isinstance(whole_html, bytes):
+            parser = self.parser(encoding)
+            if parser is not None:
+                return html.etree.HTML(whole_html, parser=parser)
+            # lxml不认识的编码，在python中解码
+            whole_html = whole_html.decode(encoding or 'utf-8', 'replace')
+        return html.etree.HTML(whole_html)
+
+    @staticmethod
+    def extract(root_element, xpaths: dict, constants: dict, is_list: bool) -> dict:
+        """
+        在同一棵DOM树上计算所有字段
+        :param root_element: DOM树
+        :param xpaths: 字段 -> 编译好的xpath
+        :param constants: 字段 -> 常量
+        :param is_list: True表示列表页，False表示实体页
+        :return: 字段 -> 值的列表
+        """
+        ret = {}
+        for key, xpath in xpaths.items():
+            content = xpath(root_element)
+            if not is_list:
+                content = ["".join([item.strip() for item in content])]
+            ret[key] = content
+        # 抓取的记录条数
+        rows = len(list(ret.get(list(ret.keys())[0])))
+        # 表达式，不是/开头；那就是常量
+        for key, value in constants.items():
+            ret[key] = [value] * rows
+        return ret
+
+    def parse(self, page)->None:
+        """
+        解析内容
+        :param page:
+        :return:
+        """
+        if page.feeder is not None:
+            root_element = page.feeder.close()
+            page.feeder = None
+        else:
+            root_element = self.tree(page.whole_html, page.encoding)
+        page.values = self.extract(root_element, page.template.xpaths, page.template.constants, page.template.is_list)
+
+    def feeder(self, page: Page, encoding: str):
+        if not self.incremental:
+            return None
+        try:
+            return HtmlFeeder(encoding, page.template.until)
+        except LookupError:
+            # lxml不认识的编码，下载完再解析
+            return None
+
+
+_process_parser = None  # 子进程中的HtmlParser
+_process_xpaths = {}    # 子进程中编译好的xpath，表达式 -> XPath
+
+
+def _process_parse(whole_html: Union[str, bytes], encoding: Optional[str], xpaths: tuple, constants: dict, is_list: bool) -> dict:
+    """
+    在子进程中解析。xpath对象不能序列化，传入的是表达式，编译后缓存在子进程中
+    :return: 字段 -> 值的列表
+    """
+    global _process_parser
+    if _process_parser is None:
+        _process_parser = HtmlParser()
+    compiled = {}
+    for key, value in xpaths:
+        if value not in _process_xpaths:
+            _process_xpaths[value] = html.etree.XPath(value, smart_strings=False)
+        compiled[key] = _process_xpaths[value]
+    return HtmlParser.extract(_process_parser.tree(whole_html, encoding), compiled, constants, is_list)
+
+
+class ProcessParser(HtmlParser):
+    """
+    在进程池中解析，使用多个cpu核心。页面内容和模板的表达式传给子进程，只把values传回来。
+    配合Spider.run(concurrency=N)使用，多个页面同时解析
+    """
+    def __init__(self, workers: Optional[int] = None):
+        """
+        初始化
+        :param workers: 进程数，不填写就是cpu核心数
+        """
+        super().__init__(incremental=False)
+        self.workers = workers
+        self.executor = None
+
+    def parse(self, page)->None:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        template = page.template
+        xpaths = tuple((key, str(template.expresses[key])) for key in template.xpaths)
+        page.values = self.executor.submit(_process_parse, page.whole_html, page.encoding, xpaths, template.constants, template.is_list).result()
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __str__(self):
+        return 'ProcessParser'
+    __repr__ = __str__
+
+
+class RssParser:
+    """
+    解析rss
+    """
+    def parse(self, url)->list:
+        feed = feedparser.parse(url)
+        return feed.get("entries")
+
+
+class ValidatorCache:
+    """
+    条件请求的缓存，增量抓取时使用。每个url的ETag、Last-Modified和内容摘要保存在本地sqlite中，
+    下次请求带上If-None-Match、If-Modified-Since，服务器返回304或者内容没变时，跳过解析和保存
+    """
+    def __init__(self, path: str = 'validators.db'):
+        """
+        初始化
+        :param path: sqlite文件路径
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS validator (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, digest TEXT)')
+        self.db.commit()
+
+    def headers(self, url: str) -> dict:
+        """
+        条件请求需要的请求头
+        :param url:
+        :return:
+        """
+        with self.lock:
+            row = self.db.execute('SELECT etag, last_modified FROM validator WHERE url = ?', (url,)).fetchone()
+        ret = {}
+        if row and row[0]:
+            ret['If-None-Match'] = row[0]
+        if row and row[1]:
+            ret['If-Modified-Since'] = row[1]
+        return ret
+
+    @staticmethod
+    def digest(content: bytes) -> str:
+        return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+    def unchanged(self, url: str, status: int, content: bytes) -> bool:
+        """
+        判断页面是否没有变化，只读，不更新缓存
+        :param url:
+        :param status: 响应的状态码
+        :param content: 响应的内容
+        :return: True表示没有变化
+        """
+        if status == 304:
+            return True
+        if status != 200:
+            return False
+        with self.lock:
+            row = self.db.execute('SELECT digest FROM validator WHERE url = ?', (url,)).fetchone()
+        return bool(row) and row[0] == self.digest(content)
+
+    def commit(self, url: str, etag: Optional[str], last_modified: Optional[str], digest: str) -> None:
+        """
+        页面保存成功后，更新缓存。保存失败时不更新，下次还会重新抓取
+        :param url:
+        :param etag: 响应头ETag
+        :param last_modified: 响应头Last-Modified
+        :param digest: 内容摘要
+        :return:
+        """
+        with self.lock:
+            self.db.execute('REPLACE INTO validator (url, etag, last_modified, digest) VALUES (?, ?, ?, ?)', (url, etag, last_modified, digest))
+            self.db.commit()
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __str__(self):
+        return 'ValidatorCache'
+    __repr__ = __str__
+
+
+class DnsCache:
+    """
+    进程内的DNS缓存，所有下载器共用一个。替换socket.getaddrinfo，requests、aiohttp都经过这里。
+    系统解析器不返回TTL，缓存时间使用ttl参数
+    """
+    def __init__(self, ttl: float = 300.0):
+        """
+        初始化
+        :param ttl: 缓存的秒数
+        """
+        self.ttl = ttl
+        self.cache = {}     # getaddrinfo的参数 -> (过期时间, 结果)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.original = None
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        key = (host, port, family, type, proto, flags)
+        now = time.time()
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # 解析失败不缓存，异常直接抛出
+        ret = (self.original or socket.getaddrinfo)(host, port, family, type, proto, flags)
+        with self.lock:
+            self.cache[key] = (now + self.ttl, ret)
+        return ret
+
+    def install(self) -> None:
+        """
+        替换socket.getaddrinfo，重复调用没有影响
+        :return:
+        """
+        if self.original is None:
+            self.original = socket.getaddrinfo
+            socket.getaddrinfo = self.getaddrinfo
+
+    def uninstall(self) -> None:
+        if self.original is not None:
+            socket.getaddrinfo = self.original
+            self.original = None
+
+    def prefetch(self, urls) -> None:
+        """
+        提前解析url的host，解析失败的忽略
+        :param urls:
+        :return:
+        """
+        for url in urls:
+            parts = urlsplit(url)
+            if not parts.hostname:
+                continue
+            try:
+                self.getaddrinfo(parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80), socket.AF_UNSPEC, socket.SOCK_STREAM)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.cache)}
+
+    def __str__(self):
+        return 'DnsCache'
+    __repr__ = __str__
+
+
+dns_cache = DnsCache()  # 默认共用的DNS缓存，下载器传入dns=dns_cache时启用
+
+
+class RetryPolicy:
+    """
+    下载失败的重试策略。超时、连接失败、5xx、429重新加入队列，等待时间指数增长，并加上随机抖动
+    """
+    ERRORS = ('timeout', 'connection', '5xx', '429', 'circuit')
+
+    def __init__(self, max_attempts: int = 3, base: float = 1.0, cap: float = 60.0, jitter: bool = True, errors=ERRORS, max_parks: int = 3):
+        """
+        初始化
+        :param max_attempts: 最多重试的次数，超过就放弃
+        :param max_parks: host熔断时，页面最多等待几次，超过就放弃。熔断期间没有真正请求，不算在max_attempts中
+        :param base: 第一次重试的等待秒数，之后每次翻倍
+        :param cap: 最长的等待秒数
+        :param jitter: 是否加随机抖动，避免大量页面同时重试
+        :param errors: 需要重试的失败类型
+        """
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+        self.jitter = jitter
+        self.errors = errors
+        self.max_parks = max_parks
+
+    def retryable(self, page) -> bool:
+        if page.error == 'circuit':
+            return page.error in self.errors and page.parks <= self.max_parks
+        return page.error in self.errors and page.attempts <= self.max_attempts
+
+    def backoff(self, attempts: int) -> float:
+        """
+        第attempts次重试需要等待的秒数
+        :param attempts:
+        :return:
+        """
+        seconds = min(self.cap, self.base * 2 ** (attempts - 1))
+        return seconds / 2 + random.uniform(0, seconds / 2) if self.jitter else seconds
+
+    def __str__(self):
+        return 'RetryPolicy'
+    __repr__ = __str__
+
+
+class CircuitBreaker:
+    """
+    按host熔断。连续失败threshold次就打开，reset秒内这个host的请求直接失败，不再浪费时间；
+    之后放一个请求试探，成功就恢复，失败就继续熔断
+    """
+    def __init__(self, threshold: int = 5, reset: float = 60.0):
+        """
+        初始化
+        :param threshold: 连续失败多少次打开
+        :param reset: 打开后多少秒试探
+        """
+        self.threshold = threshold
+        self.reset = reset
+        self.hosts = {}     # host -> {'failures': 连续失败次数, 'opened': 打开的时间, 'probing': 是否正在试探}
+        self.lock = threading.Lock()
+
+    def allow(self, host: str) -> bool:
+        """
+        是否允许请求这个host
+        :param host:
+        :return:
+        """
+        with self.lock:
+            st = self.hosts.get(host)
+            if not st or st['failures'] < self.threshold:
+                return True
+            if st['probing'] or time.time() < st['opened'] + self.reset:
+                return False
+            st['probing'] = True
+            return True
+
+    def record(self, host: str, ok: bool) -> None:
+        """
+        记录请求的结果
+        :param host:
+        :param ok: 是否成功
+        :return:
+        """
+        with self.lock:
+            st = self.hosts.setdefault(host, {'failures': 0, 'opened': 0.0, 'probing': False})
+            st['probing'] = False
+            if ok:
+                st['failures'] = 0
+                return
+            st['failures'] += 1
+            if st['failures'] >= self.threshold:
+                st['opened'] = time.time()
+
+    def until(self, host: str) -> float:
+        """
+        熔断到什么时间。正在试探的话，再等一会儿
+        :param host:
+        :return:
+        """
+        with self.lock:
+            st = self.hosts.get(host)
+            if not st or st['failures'] < self.threshold:
+                return 0.0
+            return max(st['opened'] + self.reset, time.time() + self.reset / 10)
+
+    def __str__(self):
+        return 'CircuitBreaker'
+    __repr__ = __str__
+
+
+class AutoThrottle:
+    """
+    按host自动限速。请求间隔跟着响应时间变化：响应快就加快，响应慢就放慢；
+    同时请求的数量，成功时慢慢增加，出错、429、5xx时减半（加性增、乘性减）；遵守Retry-After
+    """
+    def __init__(self, start_delay: float = 1.0, min_delay: float = 0.0, max_delay: float = 60.0, target_concurrency: float = 1.0, max_window: int = 16):
+        """
+        初始化
+        :param start_delay: 初始的请求间隔秒数
+        :param min_delay: 最小的请求间隔秒数
+        :param max_delay: 最大的请求间隔秒数
+        :param target_concurrency: 期望每个host平均同时进行的请求数量，请求间隔 = 响应时间 / target_concurrency
+        :param max_window: 每个host同时进行的请求数量上限
+        """
+        self.start_delay = start_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.target_concurrency = target_concurrency
+        self.max_window = max_window
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def __state(self, host: str) -> dict:
+        st = self.hosts.get(host)
+        if st is None:
+            st = self.hosts[host] = {'delay': self.start_delay, 'window': 1.0, 'inflight': 0, 'next': 0.0}
+        return st
+
+    def reserve(self, host: str) -> float:
+        """
+        尝试占用一个请求的位置
+        :param host:
+        :return: 0表示占用成功；否则返回需要等待的秒数
+        """
+        with self.lock:
+            st = self.__state(host)
+            now = time.time()
+            if st['inflight'] >= int(st['window']):
+                return 0.05
+            if now < st['next']:
+                return st['next'] - now
+            st['inflight'] += 1
+            st['next'] = now + st['delay']
+            return 0
+
+    def wait(self, host: str) -> None:
+        """
+        等到可以请求为止
+        :param host:
+        :return:
+        """
+        while True:
+            seconds = self.reserve(host)
+            if not seconds:
+                return
+            time.sleep(seconds)
+
+    async def acquire(self, host: str) -> None:
+        """
+        异步等到可以请求为止
+        :param host:
+        :return:
+        """
+        while True:
+            seconds = self.reserve(host)
+            if not seconds:
+                return
+            await asyncio.sleep(seconds)
+
+    @staticmethod
+    def retry_after(value) -> float:
+        """
+        解析Retry-After，可以是秒数，也可以是时间
+        :param value:
+        :return: 需要等待的秒数
+        """
+        if not value:
+            return 0
+        value = str(value).strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return 0
+
+    def release(self, host: str, latency: float, status: Optional[int], retry_after=None) -> None:
+        """
+        请求结束，根据结果调整
+        :param host:
+        :param latency: 响应时间
+        :param status: 状态码，出错时是None
+        :param retry_after: 响应头Retry-After的值
+        :return:
+        """
+        with self.lock:
+            st = self.__state(host)
+            st['inflight'] -= 1
+            if status is None or status == 429 or status >= 500:
+                st['window'] = max(1.0, st['window'] / 2)
+                st['delay'] = min(self.max_delay, max(st['delay'] * 2, self.start_delay))
+            else:
+                st['window'] = min(float(self.max_window), st['window'] + 1 / st['window'])
+                # 只有正常的响应才能加快，错误页面通常响应很快，不能作为依据
+                target = latency / self.target_concurrency
+                if status < 300 or target > st['delay']:
+                    st['delay'] = min(self.max_delay, max(self.min_delay, (st['delay'] + target) / 2))
+            seconds = self.retry_after(retry_after)
+            if seconds:
+                st['next'] = max(st['next'], time.time() + seconds)
+
+    def stats(self) -> dict:
+        """
+        每个host当前的请求间隔、同时请求数量
+        :return:
+        """
+        with self.lock:
+            return {host: dict(st) for host, st in self.hosts.items()}
+
+    def __str__(self):
+        return 'AutoThrottle'
+    __repr__ = __str__
+
+
+class Downloader:
+    """
+    下载器
+    """
+    CHARSET_REGEX = re.compile(r'charset=["\']?([\w-]+)', re.I)
+    META_REGEX = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.I)
+    HTML_TYPES = ('text/html', 'application/xhtml+xml', 'text/xml', 'application/xml', 'text/plain')
+    cache = None    # 条件请求的缓存
+    max_size = 0    # 内容的最大字节数，0表示不限制
+    content_types = None    # 允许的Content-Type，None表示不限制
+    throttle = None     # 自动限速
+    breaker = None      # 按host熔断
+    dns = None      # DNS缓存
+    executor = None     # 运行fetch(...)的线程池，None表示默认线程池
+
+    def fetch(self, spider, page: Page, headers: Optional[dict]) -> tuple:
+        """
+        网络请求，子类实现
+        :param spider:
+        :param page:
+        :param headers: 额外的请求头
+        :return: (状态码, 响应头, 内容)。不需要内容时，内容是None
+        """
+        return 200, {}, None
+
+    async def afetch(self, spider, page: Page, headers: Optional[dict]) -> tuple:
+        """
+        异步网络请求，默认在线程池中运行fetch(...)
+        :param spider:
+        :param page:
+        :param headers: 额外的请求头
+        :return: (状态码, 响应头, 内容)
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.fetch, spider, page, headers)
+
+    @staticmethod
+    def classify(status: Optional[int] = None, error: Optional[BaseException] = None) -> Optional[str]:
+        """
+        失败分类
+        :param status: 状态码
+        :param error: 异常
+        :return: timeout、connection、5xx、429，不是下载失败返回None
+        """
+        if error is not None:
+            if isinstance(error, (requests.Timeout, asyncio.TimeoutError, socket.timeout)):
+                return 'timeout'
+            if isinstance(error, (requests.ConnectionError, aiohttp.ClientConnectionError, ConnectionError)):
+                return 'connection'
+            return None
+        if status == 429:
+            return '429'
+        if status is not None and status >= 500:
+            return '5xx'
+        return None
+
+    def __begin(self, spider, page: Page, host: str) -> bool:
+        page.error = None
+        page.feeder = None
+        page.validator = None
+        if self.breaker and not self.breaker.allow(host):
+            page.error = 'circuit'
+            spider.logger.error('下载 {url}跳过  {host}已熔断'.format(url=page.url, host=host))
+            return False
+        return True
 
-    def put(self, ele)->bool:
+    def __end(self, spider, page: Page, host: str, start: float, status: Optional[int], headers, error: Optional[BaseException]) -> None:
+        if self.throttle:
+            self.throttle.release(host, time.time() - start, status, headers.get('Retry-After'))
+        page.error = self.classify(status, error)
+        if self.breaker:
+            self.breaker.record(host, page.error is None)
+        if page.error and error is None:
+            spider.logger.error('下载 {url}失败  状态码{status}'.format(url=page.url, status=status))
+
+    def __error(self, spider, page: Page, error: Exception) -> None:
+        # 出错的页面不保存，也不更新条件请求的缓存。网络错误只记录原因，其他错误记录完整的堆栈。
+        # 其他错误（解码、解析、读取中断）记为error，不重试，也不加入去重，下次运行还会抓取
+        page.skip = True
+        page.validator = None
+        if page.error:
+            spider.logger.error('下载 {url}失败  {error} {msg}'.format(url=page.url, error=page.error, msg=repr(error)))
+        else:
+            page.error = 'error'
+            spider.logger.error('下载 {url}报错  {msg}'.format(url=page.url, msg='traceback.format_exc():\n%s' % traceback.format_exc()))
+
+    def download(self, spider, page: Page) -> bool:
         """
-        插入到尾部
-        :param ele:
+        下载页面：熔断、限速、请求、解析。失败的类型记录在page.error
+        :param spider:
+        :param page:
         :return:
         """
-        self.q.append(ele)
+        host = urlsplit(page.url).netloc.lower()
+        if not self.__begin(spider, page, host):
+            return True
+        if self.throttle:
+            self.throttle.wait(host)
+        start = time.time()
+        status, headers, error = None, {}, None
+        try:
+            try:
+                status, headers, body = self.fetch(spider, page, self.cache.headers(page.url) if self.cached(page) else None)
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                self.__end(spider, page, host, start, status, headers, error)
+            if page.error or body is None:
+                page.skip = True
+            else:
+                self.finish(spider, page, status, headers, body, start)
+        except Exception as e:
+            self.__error(spider, page, e)
         return True
 
-    def head(self):
+    def cached(self, page: Page) -> bool:
         """
-        只读取，不删除
+        是否使用条件请求。只有最后一级页面使用：有下一级的页面每次都要解析出链接，下一级页面上次保存失败时才能重新抓取
+        :param page:
         :return:
         """
-        return self.q[0] if len(self.q) else None
+        return self.cache is not None and page.template.child is None
 
-    def remove_head(self):
+    def accept(self, spider, page: Page, headers) -> bool:
         """
-        删除头部元素，并返回
-        :return:
+        读取内容之前，根据响应头判断是否需要读取
+        :param spider:
+        :param page:
+        :param headers: 响应头
+        :return: False表示不读取，跳过这个页面
         """
-        ele = self.q.pop(0)
-        return ele
+        content_type = (headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        if self.content_types and content_type and content_type not in self.content_types:
+            spider.logger.info('跳过 {url} 类型是{type}'.format(url=page.url, type=content_type))
+            return False
+        length = headers.get('Content-Length') or ''
+        if self.max_size and length.isdigit() and int(length) > self.max_size:
+            spider.logger.info('跳过 {url} 大小是{length}字节'.format(url=page.url, length=length))
+            return False
+        return True
 
-    def len(self)->int:
-        return len(self.q)
+    def oversize(self, spider, page: Page, body) -> bool:
+        """
+        边下载边判断是否超过最大字节数
+        :param spider:
+        :param page:
+        :param body: 已经下载的内容
+        :return: True表示超过，停止下载
+        """
+        if self.max_size and len(body) > self.max_size:
+            spider.logger.info('跳过 {url} 大小超过{max_size}字节'.format(url=page.url, max_size=self.max_size))
+            return True
+        return False
 
-    def __str__(self):
-        return 'MemoryScheduler'
-    __repr__ = __str__
+    def read(self, spider, page: Page, headers, chunks) -> Optional[bytes]:
+        """
+        流式读取内容：先看响应头，再边下载边判断大小，解析器支持时边下载边解析
+        :param spider:
+        :param page:
+        :param headers: 响应头
+        :param chunks: 一块一块的内容
+        :return: 内容。不需要读取或者超过最大字节数时返回None
+        """
+        if not self.accept(spider, page, headers):
+            return None
+        body = bytearray()
+        incremental = getattr(spider.parser, 'incremental', False)
+        for chunk in chunks:
+            body += chunk
+            if self.oversize(spider, page, body):
+                return None
+            if incremental:
+                if self.feed(spider, page, headers, body, chunk):
+                    break
+                # 内容够判断编码了，还是没有feeder，这个页面不再尝试增量解析
+                incremental = page.feeder is not None or len(body) < 4096
+        return bytes(body)
+
+    async def aread(self, spider, page: Page, headers, chunks) -> Optional[bytes]:
+        """
+        异步流式读取内容，同read(...)
+        :param spider:
+        :param page:
+        :param headers: 响应头
+        :param chunks: 一块一块的内容，异步迭代器
+        :return: 内容。不需要读取或者超过最大字节数时返回None
+        """
+        if not self.accept(spider, page, headers):
+            return None
+        body = bytearray()
+        incremental = getattr(spider.parser, 'incremental', False)
+        async for chunk in chunks:
+            body += chunk
+            if self.oversize(spider, page, body):
+                return None
+            if incremental:
+                if self.feed(spider, page, headers, body, chunk):
+                    break
+                incremental = page.feeder is not None or len(body) < 4096
+        return bytes(body)
+
+    def feed(self, spider, page: Page, headers, body, chunk: bytes) -> bool:
+        """
+        边下载边解析。解析器支持增量解析时，内容够判断编码后开始解析
+        :param spider:
+        :param page:
+        :param headers: 响应头
+        :param body: 已经下载的内容
+        :param chunk: 刚下载的一块内容
+        :return: True表示需要的内容已经完整，停止下载
+        """
+        if page.feeder is None:
+            if len(body) < 4096:
+                return False
+            page.feeder = spider.parser.feeder(page, self.charset(headers, body))
+            if page.feeder is None:
+                return False
+            done = page.feeder.feed(bytes(body))
+        else:
+            done = page.feeder.feed(chunk)
+        if done:
+            spider.logger.info('提前结束 {url} 已下载{size}字节'.format(url=page.url, size=len(body)))
+        return done
 
+    @classmethod
+    def charset(cls, headers, body: bytes) -> str:
+        """
+        判断编码，先看响应头，再看meta标签，都没有或者不认识就是utf-8。
+        返回页面中写的名称，不换成python的名称：euc_jp、mac_roman这样的python名称lxml不认识
+        :param headers: 响应头
+        :param body: 内容
+        :return: 编码名称
+        """
+        m = cls.CHARSET_REGEX.search(headers.get('Content-Type') or '')
+        name = m.group(1) if m else None
+        if not name:
+            m = cls.META_REGEX.search(body[:4096])
+            name = m.group(1).decode('ascii') if m else None
+        if not name:
+            return 'utf-8'
+        try:
+            codecs.lookup(name)
+            return name
+        except LookupError:
+            return 'utf-8'
 
-class Hooker:
-    """
-    专门用于hook的类
-    """
-    def before_download(self, page)->None:
+    def finish(self, spider, page: Page, status: int, headers, body: bytes, start: float) -> None:
         """
-        下载页面之前
+        下载完成后的处理：判断是否有变化、解析、钩子、日志
+        :param spider:
+        :param page:
+        :param status: 状态码
+        :param headers: 响应头
+        :param body: 内容，不解码，直接交给lxml
+        :param start: 开始下载的时间
+        :return:
+        """
+        if self.cached(page) and self.cache.unchanged(page.url, status, body):
+            page.skip = True
+            spider.logger.info('未修改 {url}'.format(url=page.url), (time.time() - start))
+            return
+        # 提前结束时内容不完整，不更新缓存
+        truncated = page.feeder is not None and page.feeder.done
+        if self.cached(page) and status == 200 and not truncated:
+            page.validator = (headers.get('ETag'), headers.get('Last-Modified'), self.cache.digest(body))
+        page.whole_html = body
+        page.encoding = self.charset(headers, body)
+        self.parse(spider, page)
+        page.template.hooker.after_download(page)
+        page.release_html()
+        rows = len(list(page.values.get(list(page.values.keys())[0]))) if page.values else 0
+        spider.logger.info('下载 {url} {msg} 共计{count}条 '.format(url=page.url, msg='', count=rows),(time.time() - start))
+
+    async def adownload(self, spider, page: Page) -> bool:
+        """
+        异步下载页面：熔断、限速、请求、解析。解析是cpu密集的，放到线程池中，不阻塞事件循环
+        :param spider:
         :param page:
         :return:
         """
+        host = urlsplit(page.url).netloc.lower()
+        if not self.__begin(spider, page, host):
+            return True
+        if self.throttle:
+            await self.throttle.acquire(host)
+        start = time.time()
+        status, headers, error = None, {}, None
+        try:
+            try:
+                status, headers, body = await self.afetch(spider, page, self.cache.headers(page.url) if self.cached(page) else None)
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                self.__end(spider, page, host, start, status, headers, error)
+            if page.error or body is None:
+                page.skip = True
+            else:
+                await asyncio.get_running_loop().run_in_executor(None, self.finish, spider, page, status, headers, body, start)
+        except Exception as e:
+            self.__error(spider, page, e)
+        return True
+
+    async def aclose(self) -> None:
+        """
+        异步运行结束后，释放资源
+        :return:
+        """
         pass
 
-    def after_download(self, page)->None:
+    def close(self) -> None:
         """
-        下载页面之后
-        :param page:
+        同步运行结束后，释放资源
         :return:
         """
         pass
 
-    def before_save(self, page)->None:
+    def parse(self, spider, page: Page) -> None:
         """
-        保存数据之前
+        下载后解析页面。内容重复的页面不解析，也不保存
+        :param spider:
         :param page:
         :return:
         """
-        pass
+        if spider.content_redup and spider.content_redup.duplicated(page.whole_html, page.encoding):
+            page.skip = True
+            spider.logger.info('内容重复 {url}'.format(url=page.url))
+            return
+        spider.parser.parse(page)
 
+    def __str__(self):
+        return 'Downloader'
 
-class Template:
-    def __init__(self, urls:list, expresses:dict, next:str, fields_tag:dict, fields:dict, is_list:bool, hooker: Hooker = Hooker()):
+
+class RequestsDownloader(Downloader):
+    """
+    使用RequestsDownloader渲染后下载页面。使用同一个Session，连接保持复用，不用每次都重新握手
+    """
+    def __init__(self, timeout=(5, 30), pool_connections: int = 10, pool_maxsize: int = 10, workers: int = 0, headers: Optional[dict] = None, cache: Optional[ValidatorCache] = None,
+                 max_size: int = 10 * 1024 * 1024, content_types=Downloader.HTML_TYPES, throttle: Optional[AutoThrottle] = None,
+                 breaker: Optional[CircuitBreaker] = None, dns: Optional[DnsCache] = None):
         """
-        :param urls:
-        :param expresses:
-        :param next:
-        :param fields_tag: 表名，表示每个模板可以保存到不同的表中
-        :param fields:
-        :param is_list: True表示列表页，False表示实体页
+        初始化
+        :param timeout: 超时秒数，可以是(连接超时, 读取超时)
+        :param pool_connections: 连接池缓存的host数量
+        :param pool_maxsize: 每个host保持的最大连接数，并发下载时不要小于workers
+        :param workers: 线程池的线程数。Spider.run(concurrency=N)时在这个线程池中同时下载，0表示使用默认线程池
+        :param headers: 每个请求都带上的请求头
+        :param cache: 条件请求的缓存，增量抓取时使用
+        :param max_size: 内容的最大字节数，超过就停止下载，跳过这个页面。0表示不限制
+        :param content_types: 允许的Content-Type，其他类型不下载内容。None表示不限制
+        :param throttle: 自动限速，不填写就不限速
+        :param breaker: 按host熔断，不填写就不熔断
+        :param dns: DNS缓存，一般传入dns_cache，所有下载器共用
         """
-        assert urls, "urls参数不能空"
-        assert isinstance(urls, list), "urls参数不能空，必须是list"
-        assert expresses, "字段表达式不能空，必须是xpath表达式"
-        self.urls = urls
-        self.expresses = expresses
-        self.next = next
-        self.fields_tag = fields_tag
-        self.fields = fields
-        self.is_list = is_list
-        self.hooker = hooker
-        self.child:Template = None  #下一级的模板
+        self.timeout = timeout
+        self.cache = cache
+        self.max_size = max_size
+        self.content_types = content_types
+        self.throttle = throttle
+        self.breaker = breaker
+        self.dns = dns
+        if dns:
+            dns.install()
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections, pool_maxsize=max(pool_maxsize, workers))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if headers:
+            self.session.headers.update(headers)
+        self.executor = ThreadPoolExecutor(max_workers=workers) if workers else None
+
+    def fetch(self, spider, page: Page, headers: Optional[dict]) -> tuple:
+        # 流式下载，先看响应头，再边下载边判断大小
+        with self.session.get(page.url, timeout=self.timeout, headers=headers, stream=True) as resp:
+            return resp.status_code, resp.headers, self.read(spider, page, resp.headers, resp.iter_content(chunk_size=65536))
 
     def __str__(self):
-        return f'(Template:  urls={self.urls}  expresses={self.expresses}  next={self.next}  fields_tag={self.fields_tag}  fields={self.fields} is_list={self.is_list} child={self.child})'
-    __repr__ = __str__
+        return 'RequestsDownloader'
 
 
-class Page:
-    def __init__(self, parent: Optional[str], url: str, template: Template):
+class AiohttpDownloader(Downloader):
+    """
+    使用aiohttp异步下载页面。Spider.run(concurrency=N)时，同时有N个请求在进行
+    """
+    def __init__(self, timeout: float = 30, cache: Optional[ValidatorCache] = None, max_size: int = 10 * 1024 * 1024, content_types=Downloader.HTML_TYPES, throttle: Optional[AutoThrottle] = None,
+                 breaker: Optional[CircuitBreaker] = None, dns: Optional[DnsCache] = None):
         """
-        初始化方法，很重要。parent是上级页面的url
-        :param parent: 上级页面的url
-        :param url:  本页面的url
-        :param template: 本页面对应的模板
+        初始化
+        :param timeout: 每个请求的超时秒数
+        :param cache: 条件请求的缓存，增量抓取时使用
+        :param max_size: 内容的最大字节数，超过就停止下载，跳过这个页面。0表示不限制
+        :param content_types: 允许的Content-Type，其他类型不下载内容。None表示不限制
+        :param throttle: 自动限速，不填写就不限速
+        :param breaker: 按host熔断，不填写就不熔断
+        :param dns: DNS缓存，一般传入dns_cache，所有下载器共用
         """
-        self.parent = parent
-        self.url = url
-        self.template = template
-        self.whole_html = ''
-        self.values: dict = {}    #抓取页面后的值，保存到这里
+        self.timeout = timeout
+        self.cache = cache
+        self.max_size = max_size
+        self.content_types = content_types
+        self.throttle = throttle
+        self.breaker = breaker
+        self.dns = dns
+        if dns:
+            dns.install()
+        self.session = None
+
+    async def afetch(self, spider, page: Page, headers: Optional[dict]) -> tuple:
+        if self.session is None:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout), connector=aiohttp.TCPConnector(limit=0))
+        async with self.session.get(page.url, headers=headers) as resp:
+            return resp.status, resp.headers, await self.aread(spider, page, resp.headers, resp.content.iter_chunked(65536))
+
+    async def aclose(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def download(self, spider, page: Page) -> bool:
+        async def once():
+            try:
+                return await self.adownload(spider, page)
+            finally:
+                await self.aclose()
+        return asyncio.run(once())
 
     def __str__(self):
-        return f'(Page: parent={self.parent}  url={self.url}  values={self.values}  template={self.template})'
-    __repr__ = __str__
+        return 'AiohttpDownloader'
 
 
-class Parser:
-    def parse(self, page:Page):
+class HttpxDownloader(Downloader):
+    """
+    使用httpx下载页面，支持HTTP/2，需要安装httpx[http2]。
+    Spider.run(concurrency=N)时，同一个host的N个请求在一个连接上多路复用
+    """
+    def __init__(self, timeout: float = 30, http1: bool = True, verify: bool = True, max_connections: int = 100, headers: Optional[dict] = None,
+                 cache: Optional[ValidatorCache] = None, max_size: int = 10 * 1024 * 1024, content_types=Downloader.HTML_TYPES, throttle: Optional[AutoThrottle] = None,
+                 breaker: Optional[CircuitBreaker] = None, dns: Optional[DnsCache] = None):
+        """
+        初始化
+        :param timeout: 每个请求的超时秒数
+        :param http1: 是否允许HTTP/1.1。https通过ALPN协商HTTP/2；False时http也直接使用HTTP/2(h2c)，用于本地测试服务器
+        :param verify: 是否校验证书，本地自签名证书的测试服务器可以设置为False
+        :param max_connections: 最大连接数
+        :param headers: 每个请求都带上的请求头
+        :param cache: 条件请求的缓存，增量抓取时使用
+        :param max_size: 内容的最大字节数，超过就停止下载，跳过这个页面。0表示不限制
+        :param content_types: 允许的Content-Type，其他类型不下载内容。None表示不限制
+        :param throttle: 自动限速，不填写就不限速
+        :param breaker: 按host熔断，不填写就不熔断
+        :param dns: DNS缓存，一般传入dns_cache，所有下载器共用
+        """
+        import httpx
+        self.options = {'http2': True, 'http1': http1, 'verify': verify, 'timeout': timeout, 'headers': headers,
+                        'limits': httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)}
+        self.cache = cache
+        self.max_size = max_size
+        self.content_types = content_types
+        self.throttle = throttle
+        self.breaker = breaker
+        self.dns = dns
+        if dns:
+            dns.install()
+        self.client = None
+        self.aclient = None
+
+    @staticmethod
+    def classify(status: Optional[int] = None, error: Optional[BaseException] = None) -> Optional[str]:
+        import httpx
+        if isinstance(error, httpx.TimeoutException):
+            return 'timeout'
+        if isinstance(error, httpx.NetworkError):
+            return 'connection'
+        return Downloader.classify(status, error)
+
+    def fetch(self, spider, page: Page, headers: Optional[dict]) -> tuple:
+        if self.client is None:
+            import httpx
+            self.client = httpx.Client(**self.options)
+        with self.client.stream('GET', page.url, headers=headers) as resp:
+            return resp.status_code, resp.headers, self.read(spider, page, resp.headers, resp.iter_bytes(65536))
+
+    async def afetch(self, spider, page: Page, headers: Optional[dict]) -> tuple:
+        if self.aclient is None:
+            import httpx
+            self.aclient = httpx.AsyncClient(**self.options)
+        async with self.aclient.stream('GET', page.url, headers=headers) as resp:
+            return resp.status_code, resp.headers, await self.aread(spider, page, resp.headers, resp.aiter_bytes(65536))
+
+    async def aclose(self) -> None:
+        if self.aclient is not None:
+            await self.aclient.aclose()
+            self.aclient = None
+
+    def close(self) -> None:
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    def __str__(self):
+        return 'HttpxDownloader'
+
+
+class Browser:
+    """
+    渲染用的浏览器，子类实现。new_tab(...)返回的标签页需要有这些异步方法：
+    block(资源类型), goto(url, 超时秒数)->(状态码, 响应头), wait_for(css选择器, 超时秒数), content()->html, close()
+    """
+    async def new_tab(self):
+        raise NotImplementedError
+
+    async def close(self) -> None:
         pass
 
+    def __str__(self):
+        return 'Browser'
+    __repr__ = __str__
 
-class HtmlParser(Parser):
-    def parse(self, page)->None:
+
+class PyppeteerTab:
+    """
+    pyppeteer的标签页
+    """
+    def __init__(self, page):
+        self.page = page
+
+    async def block(self, types) -> None:
         """
-        解析内容
-        :param page:
+        拦截指定类型的资源，比如image、font、media，不下载
+        :param types:
         :return:
         """
-        root_element = html.etree.HTML(page.whole_html)
+        if not types:
+            return
+        await self.page.setRequestInterception(True)
+        self.page.on('request', lambda req: asyncio.ensure_future(req.abort() if req.resourceType in types else req.continue_()))
 
-        ret = {}
-        for key, value in page.template.expresses.items():
-            value = str(value)
-            if value.startswith("/"):
-                content = root_element.xpath(value)
-                if not page.template.is_list:
-                    content = ["".join([item.strip() for item in content])]
-                ret[key] = content
-        # 抓取的记录条数
-        rows = len(list(ret.get(list(ret.keys())[0])))
-        # 表达式，不是/开头；那就是常量
-        for key, value in page.template.expresses.items():
-            value = str(value)
-            if not value.startswith("/"):
-                ret[key] = [str(value) for i in range(rows)]
-        page.values = ret
+    async def goto(self, url: str, timeout: float) -> tuple:
+        resp = await self.page.goto(url, {'timeout': timeout * 1000, 'waitUntil': 'domcontentloaded'})
+        return (resp.status, resp.headers) if resp else (200, {})
 
+    async def wait_for(self, selector: str, timeout: float) -> None:
+        await self.page.waitForSelector(selector, {'timeout': timeout * 1000})
 
-class RssParser:
+    async def content(self) -> str:
+        return await self.page.content()
+
+    async def close(self) -> None:
+        await self.page.close()
+
+
+class PyppeteerBrowser(Browser):
     """
-    解析rss
+    使用pyppeteer驱动的无头chrome，需要安装pyppeteer
     """
-    def parse(self, url)->list:
-        feed = feedparser.parse(url)
-        return feed.get("entries")
+    def __init__(self, options: Optional[dict] = None):
+        """
+        初始化
+        :param options: 传给pyppeteer.launch(...)的参数
+        """
+        self.options = options if options else {'headless': True, 'args': ['--no-sandbox', '--disable-setuid-sandbox']}
+        self.browser = None
 
+    async def new_tab(self):
+        if self.browser is None:
+            from pyppeteer import launch
+            self.browser = await launch(self.options)
+        return PyppeteerTab(await self.browser.newPage())
 
-class Downloader:
+    async def close(self) -> None:
+        if self.browser is not None:
+            await self.browser.close()
+            self.browser = None
+
+    def __str__(self):
+        return 'PyppeteerBrowser'
+    __repr__ = __str__
+
+
+class TabPool:
     """
-    下载器
+    标签页池。标签页用完后放回池中，下次直接使用，不用每次都新建
     """
-    def download(self, spider, page: Page) -> bool:
-        return True
+    def __init__(self, browser: Browser, size: int = 4, block=()):
+        """
+        初始化
+        :param browser: 浏览器
+        :param size: 最多同时打开的标签页数量，也是同时渲染的页面数量
+        :param block: 拦截的资源类型
+        """
+        self.browser = browser
+        self.size = size
+        self.block = block
+        self.idle = deque()     # 空闲的标签页
+        self.slots = asyncio.Semaphore(size)    # 剩余的名额，出错的标签页关闭后名额空出来，唤醒等待的任务
+        self.created = 0
+
+    async def acquire(self):
+        """
+        取出一个标签页：先等待名额，有空闲的直接使用，没有就新建
+        :return:
+        """
+        await self.slots.acquire()
+        if self.idle:
+            return self.idle.pop()
+        try:
+            tab = await self.browser.new_tab()
+            try:
+                await tab.block(self.block)
+            except:
+                await self.discard(tab)
+                raise
+        except:
+            self.slots.release()
+            raise
+        self.created += 1
+        return tab
+
+    async def release(self, tab, broken: bool = False) -> None:
+        """
+        标签页放回池中，出错的标签页关闭
+        :param tab:
+        :param broken: 是否出错
+        :return:
+        """
+        if broken:
+            self.created -= 1
+            await self.discard(tab)
+        else:
+            self.idle.append(tab)
+        self.slots.release()
+
+    @staticmethod
+    async def discard(tab) -> None:
+        try:
+            await tab.close()
+        except:
+            pass
+
+    async def close(self) -> None:
+        while self.idle:
+            await self.discard(self.idle.pop())
+        self.created = 0
+        await self.browser.close()
 
     def __str__(self):
-        return 'Downloader'
+        return 'TabPool'
+    __repr__ = __str__
 
 
-class RequestsDownloader(Downloader):
+class RenderDownloader(Downloader):
     """
-    使用RequestsDownloader渲染后下载页面
+    使用浏览器渲染后下载页面。标签页放在池中重复使用，Spider.run(concurrency=N)时同时渲染多个页面
     """
-    def download(self, spider, page: Page) -> bool:
+    def __init__(self, browser: Optional[Browser] = None, tabs: int = 4, block=('image', 'font', 'media'), wait_for: str = '', timeout: float = 10.0,
+                 cache: Optional[ValidatorCache] = None, throttle: Optional[AutoThrottle] = None, breaker: Optional[CircuitBreaker] = None):
+        """
+        初始化
+        :param browser: 浏览器，不填写就使用PyppeteerBrowser
+        :param tabs: 标签页池的大小
+        :param block: 拦截的资源类型，不下载图片、字体、音视频可以快很多
+        :param wait_for: css选择器，页面出现这个元素就开始解析。不填写就在DOMContentLoaded后解析
+        :param timeout: 打开页面、等待元素的超时秒数
+        :param cache: 条件请求的缓存，增量抓取时使用
+        :param throttle: 自动限速，不填写就不限速
+        :param breaker: 按host熔断，不填写就不熔断
+        """
+        self.browser = browser if browser else PyppeteerBrowser()
+        self.tabs = tabs
+        self.block = block
+        self.wait_for = wait_for
+        self.timeout = timeout
+        self.cache = cache
+        self.throttle = throttle
+        self.breaker = breaker
+        self.pool = None
+        self.loop = None    # 同步运行时使用的事件循环
+
+    async def afetch(self, spider, page: Page, headers: Optional[dict]) -> tuple:
+        if self.pool is None:
+            self.pool = TabPool(self.browser, size=self.tabs, block=self.block)
+        tab = await self.pool.acquire()
+        broken = True
         try:
-            start = time.time()
-            content = requests.get(page.url).text
-            page.whole_html = content
-            spider.parser.parse(page)
-            page.template.hooker.after_download(page)
-            rows = len(list(page.values.get(list(page.values.keys())[0])))
-            spider.logger.info('下载 {url} {msg} 共计{count}条 '.format(url=page.url, msg='', count=rows),(time.time() - start))
-        except:
-            spider.logger.error('下载 {url}报错  {msg}'.format(url=page.url, msg='traceback.format_exc():\n%s' % traceback.format_exc()))
-        return True
+            status, resp_headers = await tab.goto(page.url, self.timeout)
+            if self.wait_for:
+                try:
+                    await tab.wait_for(self.wait_for, self.timeout)
+                except:
+                    spider.logger.info('等待 {url} {selector}超时'.format(url=page.url, selector=self.wait_for))
+            body = (await tab.content()).encode('utf8')
+            broken = False
+        finally:
+            await self.pool.release(tab, broken)
+        # 渲染后的内容已经是utf-8，忽略页面原来的编码
+        resp_headers = dict(resp_headers)
+        resp_headers.pop('content-type', None)
+        resp_headers['Content-Type'] = 'text/html; charset=utf-8'
+        return status, resp_headers, body
+
+    def download(self, spider, page: Page) -> bool:
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+        return self.loop.run_until_complete(self.adownload(spider, page))
+
+    async def aclose(self) -> None:
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    def close(self) -> None:
+        if self.loop is not None:
+            self.loop.run_until_complete(self.aclose())
+            self.loop.close()
+            self.loop = None
 
     def __str__(self):
-        return 'RequestsDownloader'
+        return 'RenderDownloader'
 
 
 class Spider:
@@ -504,16 +3196,19 @@ class Spider:
         r'(?::\d+)?'  # optional port
         r'(?:/?|[/?]\S+)$', re.IGNORECASE)
 
-    def __init__(self, alias: str, downloader: Downloader = RequestsDownloader(), redup: MemoryRedup = MemoryRedup(), scheduler: MemoryScheduler = MemoryScheduler(), parser: Parser = HtmlParser(), pipeline: ConsolePipeline = ConsolePipeline(), logger: ConsoleLogger = ConsoleLogger()):
+    def __init__(self, alias: str, downloader: Downloader = RequestsDownloader(), redup: MemoryRedup = MemoryRedup(), scheduler: MemoryScheduler = MemoryScheduler(), parser: Parser = HtmlParser(), pipeline: ConsolePipeline = ConsolePipeline(), logger: ConsoleLogger = ConsoleLogger(), content_redup: Optional[MemoryContentRedup] = None, retry: Optional[RetryPolicy] = RetryPolicy(), release_values: bool = False):
         """
         实例化爬虫类，各个参数很重要，需要认真填写
         :param alias: 网站名称，方便记忆
         :param pattern: 运行模式，可选值有1、2。值1表示使用简洁模式，值2表示使用渲染模式
-        :param redup: 判断重复的类，必须创建对象，可选类有MemoryRedup、RedisRedup
-        :param scheduler: 调度器类，必须创建对象，可选类有MemoryScheduler
+        :param redup: 判断重复的类，必须创建对象，可选类有MemoryRedup、RedisRedup、BloomRedup、ScalableBloomRedup
+        :param scheduler: 调度器类，必须创建对象，可选类有MemoryScheduler、HostScheduler、RedisScheduler、DiskScheduler
         :param parser: 条目解析器
         :param pipeline: 持久化的类，必须创建对象，可选类有ConsoleDao、FilePipeline、MySQLPipeline、WordPressPipeline
         :param logger: 日志类，必须创建对象，可选类有NoLogger、ConsoleLogger
+        :param content_redup: 判断内容重复的类，可选类有MemoryContentRedup、RedisContentRedup。不填写就不判断
+        :param retry: 下载失败的重试策略，None表示不重试
+        :param release_values: 保存成功后是否释放抓取的值，只留下next字段。页面很多、字段很大时可以节省内存
         """
         self.pid = os.getpid()
         self.logger = logger
@@ -524,9 +3219,13 @@ class Spider:
         self.scheduler = scheduler
         self.parser = parser
         self.pipeline = pipeline
+        self.content_redup = content_redup
+        self.retry = retry
+        self.release_values = release_values
+        self.inflight = set()   #已经在队列中、还没处理完的url的8字节摘要，判断重复用，见__inflight_key(...)
         self.template = None    #保存本页面对应的模板
 
-    def list(self, urls: Union[list, str] = '', expresses: dict = {}, fields_tag: str = '', fields: dict = {}, next: str = '', hooker: Hooker = Hooker()):
+    def list(self, urls: Union[list, str] = '', expresses: dict = {}, fields_tag: str = '', fields: dict = {}, next: str = '', hooker: Hooker = Hooker(), until: str = ''):
         """
         列表
         :param urls:
@@ -535,11 +3234,12 @@ class Spider:
         :param fields:
         :param next:
         :param hooker:
+        :param until:
         :return:
         """
-        return self.__page(urls=urls, is_list=True, expresses=expresses, fields_tag=fields_tag, fields=fields, next=next, hooker=hooker)
+        return self.__page(urls=urls, is_list=True, expresses=expresses, fields_tag=fields_tag, fields=fields, next=next, hooker=hooker, until=until)
 
-    def page(self, urls: Union[list, str] = '', expresses: dict = {}, fields_tag: str = '', fields: dict = {}, hooker: Hooker = Hooker()):
+    def page(self, urls: Union[list, str] = '', expresses: dict = {}, fields_tag: str = '', fields: dict = {}, hooker: Hooker = Hooker(), until: str = ''):
         """
         单页
         :param urls:
@@ -547,11 +3247,12 @@ class Spider:
         :param fields_tag:
         :param fields:
         :param hooker:
+        :param until:
         :return:
         """
-        return self.__page(urls=urls, is_list=False, expresses=expresses, fields_tag=fields_tag, fields=fields, hooker=hooker)
+        return self.__page(urls=urls, is_list=False, expresses=expresses, fields_tag=fields_tag, fields=fields, hooker=hooker, until=until)
 
-    def __page(self, urls: Union[list, str] = '', is_list: bool = False, expresses: dict = {}, fields_tag: str = '', fields: dict = {}, next: str = '', hooker: Hooker = Hooker()):
+    def __page(self, urls: Union[list, str] = '', is_list: bool = False, expresses: dict = {}, fields_tag: str = '', fields: dict = {}, next: str = '', hooker: Hooker = Hooker(), until: str = ''):
         """
         抓取信息配置
         :param urls: 被抓取的url列表，可以是list，也可以是str
@@ -564,17 +3265,18 @@ class Spider:
         也可以设置常量字段，比如时间戳之类的
         :param next: str，传递给下一级抓取时，指定的字段名，这个字段名一定出现在expresses的key中。如果url需要补全，在这里可以实现
         :param hooker: Hooker 用于hook
+        :param until: str，xpath，使用HtmlParser(incremental=True)时，这个元素出现后就停止下载和解析。一般写需要的字段后面的元素
         :return: self
         """
         urls = [urls] if isinstance(urls, str) else urls
-        t = Template(urls=urls, expresses=expresses, next=next, fields_tag=fields_tag, fields=fields, is_list=is_list, hooker=hooker)
+        t = Template(urls=urls, expresses=expresses, next=next, fields_tag=fields_tag, fields=fields, is_list=is_list, hooker=hooker, until=until)
         if self.template:
             self.template.child = t
         else:
             self.template = t
         return self
 
-    async def __download(self, page: Page)->bool:
+    def __download(self, page: Page)->bool:
         """
         下载页面
         :param page:
@@ -587,54 +3289,63 @@ class Spider:
             return False
         return self.downloader.download(self, page)
 
+    async def __adownload(self, page: Page, hosts: dict, per_host: int)->bool:
+        """
+        异步下载页面
+        :param page:
+        :param hosts: host -> 限制并发的信号量
+        :param per_host: 每个host同时下载的页面数量，0表示不限制
+        :return: 重复url，返回False；否则，返回True
+        """
+        self.logger.info('__adownload(...)')
+        page.template.hooker.before_download(page)
+        assert re.match(Spider.url_regex, page.url), "不是合法的url格式"
+        if self.redup.loaded(page.url):
+            return False
+        if not per_host:
+            return await self.downloader.adownload(self, page)
+        host = urlsplit(page.url).netloc.lower()
+        if host not in hosts:
+            hosts[host] = asyncio.Semaphore(per_host)
+        async with hosts[host]:
+            return await self.downloader.adownload(self, page)
+
+    def __retry(self, page: Page)->bool:
+        """
+        下载失败的页面，等待一段时间后重新加入队列。host熔断时，暂停这个host
+        :param page:
+        :return: True表示已经重新加入队列
+        """
+        if page.error is None:
+            return False
+        # 熔断时没有真正请求，单独计数；熔断一直不恢复，等待max_parks次后放弃
+        if page.error == 'circuit':
+            page.parks += 1
+        else:
+            page.attempts += 1
+        if not self.retry or not self.retry.retryable(page):
+            self.logger.error('放弃 {url} 失败{attempts}次 熔断{parks}次  {error}'.format(url=page.url, attempts=page.attempts, parks=page.parks, error=page.error))
+            return False
+        if page.error == 'circuit':
+            host = urlsplit(page.url).netloc.lower()
+            page.not_before = self.downloader.breaker.until(host)
+            self.scheduler.park(host, page.not_before)
+        else:
+            page.not_before = time.time() + self.retry.backoff(page.attempts)
+        self.logger.info('重试 {url} 第{attempts}次 熔断{parks}次  {error}'.format(url=page.url, attempts=page.attempts, parks=page.parks, error=page.error))
+        page.error = None
+        page.skip = False
+        self.scheduler.put(page)
+        return True
+
     def __pre_save(self, page: Page)->None:
         # self.logger.info('__pre_save(...)参数')
 
-        #使用fields内容
-        items = {}
-        if page.template.fields:
-            for k,v in page.template.fields.items():
-                # k是保存用的名字，v是抓取时用的名字
-                if v in page.values.keys(): #pid不是抓取字段，这里必须判断
-                    items[k] = page.values[v]
-        else:
-            items = page.values
-
-        # 定义一个二维数组
-        matrix = []
-        v_len = set()
-        for key, values in items.items():
-            v_len.add(len(values))
-            m = []
-            m.append(key)
-            for value in values:
-                m.append(value)
-            matrix.append(m)
-        if page.template.is_list and len(v_len) != 1:
-            raise Exception(self.alias +' 抓取字段的数量不一致 ' + str(v_len))
-
-        # 后面会根据key取值，所以Page对象增加一个新的属性
-        page.matrix = np.array(matrix).T.tolist()
-
-        # 判断是否需要pid字段
-        key_pid = None
-        for k,v in page.template.fields.items():
-            if "pid" == v:
-                key_pid = k
-                break
-        if key_pid:
-            page.matrix[0].append(key_pid)
-            for vlist in page.matrix[1:]:
-                vlist.append(page.parent)
-
-        # 判断常量字段，指的是在expresses的key中没有出现过
-        expresses_keys = page.template.expresses.keys()
-        for k,v in page.template.fields.items():
-            #不在，就是常量
-            if not str(v) in expresses_keys:
-                page.matrix[0].append(k)
-                for vlist in page.matrix[1:]:
-                    vlist.append(str(v))
+        # 按模板的保存计划取出抓取的列，pid和常量不按行展开。没有fields时保存全部抓取的字段
+        try:
+            page.matrix = page.template.plan.batch(page.values, page.parent, page.template.is_list)
+        except ValueError as e:
+            raise Exception(self.alias + ' ' + str(e))
 
         #钩子函数
         page.template.hooker.before_save(page)
@@ -649,36 +3360,70 @@ class Spider:
         # self.logger.info('__save(...)参数 {}'.format(page))
         try:
             self.pipeline.save(page.matrix, page.template.fields_tag)
+            if self.release_values:
+                page.release_values()
             return True
         except:
             self.logger.error('保存报错 {msg}'.format(msg='traceback.format_exc():\n%s' % traceback.format_exc()))
             return False
 
-    def __after_save(self, page: Page, flag:bool)->None:
+    def __after_save(self, page: Page, flag:bool, claimed:bool=False)->None:
         """
         保存后，修改调度器信息
         :param page:
         :param flag:
+        :param claimed: 并发运行时，page是领取的，不在队列头部
         :return:
         """
         # self.logger.info('__after_save(...)参数 page={} flag={}'.format(page, flag))
-        # 1、成功操作后，加入到去重队列
-        if flag:
-            self.redup.load(page.url)
-        # 2、取出url
-        if page.template.next and page.template.child:
-            next_urls = page.values[page.template.next]
-            for next_url in next_urls:
-                # 3、添加新的到队列
-                self.scheduler.put(Page(parent=page.url, url=next_url, template=page.template.child))
-        # 4、删除头元素
-        self.scheduler.remove_head()
-
-    def run(self):
+        try:
+            # 1、成功操作后，加入到去重队列；更新条件请求的缓存。下载失败的不加入
+            if flag and page.error is None:
+                self.redup.load(page.url)
+                if page.validator and self.downloader.cache:
+                    self.downloader.cache.commit(page.url, *page.validator)
+            page.validator = None
+            # 2、取出url，去掉已经在队列中的
+            if page.template.next and page.template.child:
+                next_urls = {}
+                for next_url in page.values.get(page.template.next, []):
+                    key = self.__inflight_key(next_url)
+                    if key not in self.inflight and key not in next_urls:
+                        next_urls[key] = next_url
+                # 3、一次性判断是否重复，不重复的添加到队列
+                for (key, next_url), loaded in zip(next_urls.items(), self.redup.loaded_many(list(next_urls.values()))):
+                    if not loaded:
+                        self.inflight.add(key)
+                        self.scheduler.put(Page(parent=page.url, url=next_url, template=page.template.child))
+        finally:
+            # 4、删除头元素；领取的确认完成。前面报错也要执行，不然这个页面一直留在调度器和inflight中
+            self.inflight.discard(self.__inflight_key(page.url))
+            if claimed:
+                self.scheduler.ack(page)
+            else:
+                self.scheduler.remove_head()
+
+    def __inflight_key(self, url) -> bytes:
+        """
+        inflight中使用的值：去重的值，不是摘要的话再计算8字节的摘要。
+        待抓取的url很多时，每个只占用固定的内存，和url长度无关
+        :param url:
+        :return:
+        """
+        key = self.redup.key(url)
+        if isinstance(key, str):
+            key = hashlib.blake2b(key.encode('utf8'), digest_size=8).digest()
+        return key
+
+    def run(self, concurrency: int = 1, per_host: int = 0):
         """
         开始运行
+        :param concurrency: 同时下载的页面数量。大于1时使用asyncio并发运行
+        :param per_host: 并发运行时，每个host同时下载的页面数量，0表示不限制
         :return:
         """
+        if concurrency > 1:
+            return asyncio.run(self.arun(concurrency=concurrency, per_host=per_host))
         self.logger.info('run(...)开始运行')
         try:
             self.__run()
@@ -689,23 +3434,116 @@ class Spider:
             self.logger.info('清理环境')
             self.__kill()
 
-    def __run(self):
+    async def arun(self, concurrency: int = 10, per_host: int = 0):
+        """
+        使用asyncio并发运行。
+        下载、解析、保存不在事件循环所在的线程中；调度器、去重、条件请求缓存的更新在事件循环所在的线程中同步调用，
+        使用内存中的实现没有影响，RedisRedup、RedisScheduler、DiskScheduler、ValidatorCache每次调用都会阻塞事件循环一次网络往返或者磁盘读写
+        :param concurrency: 同时下载的页面数量
+        :param per_host: 每个host同时下载的页面数量，0表示不限制
+        :return:
+        """
+        self.logger.info('arun(...)开始运行')
+        try:
+            await self.__arun(concurrency, per_host)
+            self.logger.info('运行结束')
+        except:
+            self.logger.error('运行报错 {msg}'.format(msg='traceback.format_exc():\n%s' % traceback.format_exc()))
+        finally:
+            self.logger.info('清理环境')
+            await self.downloader.aclose()
+            self.__kill()
+
+    def __seed(self, concurrency: int = 1):
         # 生成种子
+        self.scheduler.bind(self.template, prefetch=concurrency)
+        if self.downloader.dns:
+            self.downloader.dns.prefetch(self.template.urls)
         for url in self.template.urls:
+            self.inflight.add(self.__inflight_key(url))
             self.scheduler.put(Page(parent=None, url=url, template=self.template))
 
-        while self.scheduler.len():
+    def __run(self):
+        self.__seed()
+        while self.scheduler.len() or self.scheduler.busy():
             page = self.scheduler.head()
-            self.__download(page)
-
-            normal_flag = True
-            if page.template.fields:
+            if page is None:
+                # 多个进程共用队列时，剩下的Page可能刚被其他进程领走，或者其他进程还在处理、可能产生新的Page
+                time.sleep(1)
+                continue
+            if page.not_before > time.time():
+                time.sleep(max(0.0, page.not_before - time.time()))
+            if not self.__download(page):
+                page.skip = True
+            if self.__retry(page):
+                self.scheduler.remove_head()
+                continue
+
+            normal_flag = page.error is None
+            if page.template.fields and not page.skip:
                 normal_flag = self.__save(page)
             self.__after_save(page, normal_flag)
 
+    async def __arun(self, concurrency: int, per_host: int):
+        self.__seed(concurrency)
+        hosts = {}
+        tasks = set()
+        # 调度器、去重都在事件循环所在的线程中同步操作（见arun的说明）；保存只用一个线程，pipeline不需要考虑线程安全
+        with ThreadPoolExecutor(max_workers=1) as saver:
+            while True:
+                while len(tasks) < concurrency and self.scheduler.len():
+                    page = self.scheduler.claim()
+                    if page is None:
+                        break
+                    tasks.add(asyncio.ensure_future(self.__aprocess(page, hosts, per_host, saver)))
+                if not tasks:
+                    if not self.scheduler.len() and not self.scheduler.busy():
+                        break
+                    # 多个进程共用队列时，剩下的Page可能刚被其他进程领走，或者其他进程还在处理、可能产生新的Page
+                    await asyncio.sleep(1)
+                    continue
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+
+    async def __aprocess(self, page: Page, hosts: dict, per_host: int, saver: ThreadPoolExecutor):
+        """
+        并发运行时，处理一个页面：下载、解析、保存
+        :param page:
+        :param hosts:
+        :param per_host:
+        :param saver: 保存用的线程池
+        :return:
+        """
+        normal_flag = False
+        try:
+            if page.not_before > time.time():
+                await asyncio.sleep(max(0.0, page.not_before - time.time()))
+            if not await self.__adownload(page, hosts, per_host):
+                page.skip = True
+            if self.__retry(page):
+                self.scheduler.ack(page)
+                return
+            normal_flag = page.error is None
+            if page.template.fields and not page.skip:
+                normal_flag = await asyncio.get_running_loop().run_in_executor(saver, self.__save, page)
+        except:
+            self.logger.error('处理 {url}报错  {msg}'.format(url=page.url, msg='traceback.format_exc():\n%s' % traceback.format_exc()))
+        try:
+            self.__after_save(page, normal_flag, claimed=True)
+        except:
+            # 没有人读取任务的结果，这里不记录的话错误就丢失了
+            self.logger.error('处理 {url}报错  {msg}'.format(url=page.url, msg='traceback.format_exc():\n%s' % traceback.format_exc()))
+
     def __kill(self):
         """
         清理环境
         :return:
         """
+        self.redup.flush()
+        self.scheduler.close()
+        self.downloader.close()
+        self.parser.close()
+        try:
+            self.pipeline.close()
+        except:
+            self.logger.error('保存报错 {msg}'.format(msg='traceback.format_exc():\n%s' % traceback.format_exc()))
         self.logger.info('结束')
@@ -0,0 +1,49 @@
+from typing import Optional
+
+from spiderlib import *
+
+# 测试共用的替身：不访问网络的下载器，保存到列表或者不保存的pipeline，不输出info的日志
+
+
+class StubDownloader(Downloader):
+    """
+    不访问网络，返回固定的内容，没有指定时返回url作为标题
+    """
+    def __init__(self, body: Optional[str] = None, on_fetch=None):
+        """
+        初始化
+        :param body: 返回的html
+        :param on_fetch: 第一次下载时调用一次
+        """
+        self.body = body
+        self.on_fetch = on_fetch
+        self.urls = []
+
+    def fetch(self, spider, page, headers):
+        self.urls.append(page.url)
+        if self.on_fetch:
+            self.on_fetch()
+            self.on_fetch = None
+        body = self.body if self.body is not None else '<h1>{}</h1>'.format(page.url)
+        return 200, {'Content-Type': 'text/html; charset=utf-8'}, body.encode('utf8')
+
+
+class ListPipeline(ConsolePipeline):
+    """
+    保存的行放到rows中，不包含表头
+    """
+    def __init__(self):
+        self.rows = []
+
+    def save(self, values, tag):
+        self.rows.extend(list(row) for row in values[1:])
+
+
+class NullPipeline(ConsolePipeline):
+    def save(self, values, tag):
+        pass
+
+
+class NullLogger(ConsoleLogger):
+    def info(self, info, ts=0):
+        pass
@@ -0,0 +1,94 @@
+import timeit
+
+import numpy as np
+from spiderlib import *
+
+# 对比保存前的数据准备：原来每个页面都重新遍历fields、转置矩阵，现在按模板编译好的保存计划取列
+
+
+def old_pre_save(page):
+    """
+    原来的__pre_save(...)
+    :param page:
+    :return:
+    """
+    items = {}
+    if page.template.fields:
+        for k, v in page.template.fields.items():
+            if v in page.values.keys():
+                items[k] = page.values[v]
+    else:
+        items = page.values
+
+    matrix = []
+    v_len = set()
+    for key, values in items.items():
+        v_len.add(len(values))
+        m = []
+        m.append(key)
+        for value in values:
+            m.append(value)
+        matrix.append(m)
+    if page.template.is_list and len(v_len) != 1:
+        raise Exception(' 抓取字段的数量不一致 ' + str(v_len))
+
+    matrix = np.array(matrix).T.tolist()
+
+    key_pid = None
+    for k, v in page.template.fields.items():
+        if "pid" == v:
+            key_pid = k
+            break
+    if key_pid:
+        matrix[0].append(key_pid)
+        for vlist in matrix[1:]:
+            vlist.append(page.parent)
+
+    expresses_keys = page.template.expresses.keys()
+    for k, v in page.template.fields.items():
+        if not str(v) in expresses_keys:
+            matrix[0].append(k)
+            for vlist in matrix[1:]:
+                vlist.append(str(v))
+    return matrix
+
+
+def new_pre_save(page):
+    """
+    现在的__pre_save(...)
+    :param page:
+    :return:
+    """
+    return page.template.plan.batch(page.values, page.parent, page.template.is_list)
+
+
+def make_page(fields: int, rows: int, body: int):
+    """
+    构造一个抓取完的列表页
+    :param fields: 抓取的字段数量
+    :param rows: 每个字段的条数
+    :param body: 最后一个字段每条的长度，模拟正文
+    :return:
+    """
+    expresses = {'f%d' % i: '//div[%d]//text()' % i for i in range(fields)}
+    names = {'字段%d' % i: 'f%d' % i for i in range(fields)}
+    names.update({'上级': 'pid', '来源': '常量'})
+    template = Template(urls=['http://localhost/'], expresses=expresses, next='', fields_tag='', fields=names, is_list=True)
+    page = Page('http://localhost/', 'http://localhost/1.html', template)
+    page.values = {'f%d' % i: ['值%d' % j for j in range(rows)] for i in range(fields)}
+    page.values['f%d' % (fields - 1)] = ['正' * body for j in range(rows)]
+    return page
+
+
+def bench(fields: int, rows: int, body: int, number: int = 200):
+    page = make_page(fields, rows, body)
+    old = timeit.timeit(lambda: old_pre_save(page), number=number) / number
+    new = timeit.timeit(lambda: new_pre_save(page), number=number) / number
+    print('字段{:>3} 条数{:>4} 正文{:>7}字  原来{:>10.1f}微秒  现在{:>8.1f}微秒  {:>8.1f}倍'.format(fields, rows, body, old * 1e6, new * 1e6, old / new))
+
+
+if __name__ == '__main__':
+    bench(5, 1, 100)
+    bench(5, 20, 100)
+    bench(20, 50, 100)
+    bench(5, 20, 200 * 1024, number=20)
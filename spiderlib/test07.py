@@ -0,0 +1,107 @@
+import sys
+import tracemalloc
+
+from spiderlib import *
+from spiderlib.stubs import NullLogger, NullPipeline
+
+# 用tracemalloc检查每个页面处理完后还占用多少内存：页面内容解析后释放，抓取的值保存后释放
+
+
+class MemoryDownloader(Downloader):
+    """
+    不访问网络，返回一个很大的页面，正文后面是很长的评论
+    """
+    def __init__(self, size: int):
+        self.size = size
+
+    def fetch(self, spider, page, headers):
+        body = '<html><body><h1>{url}</h1><div id="c">正文</div><div id="comments">{comments}</div></body></html>'.format(url=page.url, comments='<p>评论</p>' * (self.size // 12))
+        return 200, {'Content-Type': 'text/html; charset=utf-8'}, body.encode('utf8')
+
+
+class KeepHooker(Hooker):
+    """
+    模拟页面在调度器中等待：处理完的页面都留着，看每个页面还占用多少内存
+    """
+    def __init__(self):
+        self.pages = []
+
+    def before_save(self, page):
+        self.pages.append(page)
+
+
+class InflightHooker(Hooker):
+    """
+    下载第一个页面后，记录inflight中每个url占用的字节数
+    """
+    def __init__(self):
+        self.spider = None
+        self.size = None
+
+    def after_download(self, page):
+        if self.size is None:
+            self.size = sum(sys.getsizeof(key) for key in self.spider.inflight) / len(self.spider.inflight)
+
+
+def retained(count: int, size: int, release_values: bool) -> float:
+    """
+    处理count个页面，返回每个页面还占用的字节数
+    :param count: 页面数量
+    :param size: 每个页面的字节数
+    :param release_values: 保存后是否释放抓取的值
+    :return:
+    """
+    hooker = KeepHooker()
+    spider = Spider('内存', downloader=MemoryDownloader(size), redup=MemoryRedup(), scheduler=MemoryScheduler(), pipeline=NullPipeline(), logger=NullLogger(), release_values=release_values)
+    spider.page(urls=['http://localhost/%d.html' % i for i in range(count)], expresses={'title': '//h1/text()', 'content': "//div[@id='c']//text()", 'comments': "//div[@id='comments']//text()"},
+                fields={'标题': 'title', '正文': 'content', '评论': 'comments', '上级': 'pid'}, hooker=hooker)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    spider.run()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(hooker.pages) == count
+    assert all(page.whole_html == '' for page in hooker.pages), '页面内容没有释放'
+    return (after - before) / count
+
+
+def test_release_html():
+    """
+    页面内容解析后就释放，每个页面占用的内存和页面大小无关
+    :return:
+    """
+    small = retained(50, 20 * 1024, True)
+    large = retained(50, 500 * 1024, True)
+    print('每个页面占用 20KB页面{:.0f}字节  500KB页面{:.0f}字节'.format(small, large))
+    assert large < 20 * 1024, '每个页面占用的内存太多'
+
+
+def test_release_values():
+    """
+    保存后释放抓取的值，很长的评论字段也不再占用内存
+    :return:
+    """
+    keep = retained(50, 100 * 1024, False)
+    release = retained(50, 100 * 1024, True)
+    print('每个页面占用 保留抓取的值{:.0f}字节  释放后{:.0f}字节'.format(keep, release))
+    assert release < keep
+
+
+def test_inflight():
+    """
+    inflight中保存url的摘要，每个url占用的内存和url长度无关
+    :return:
+    """
+    hooker = InflightHooker()
+    spider = Spider('内存', downloader=MemoryDownloader(1024), redup=MemoryRedup(), scheduler=MemoryScheduler(), pipeline=NullPipeline(), logger=NullLogger())
+    spider.page(urls=['http://localhost/{}/{}.html'.format('a' * 500, i) for i in range(200)], expresses={'title': '//h1/text()'}, fields={'标题': 'title'}, hooker=hooker)
+    hooker.spider = spider
+    spider.run()
+    print('inflight中每个url占用{:.0f}字节'.format(hooker.size))
+    assert hooker.size < 100, hooker.size
+
+
+if __name__ == '__main__':
+    test_release_html()
+    test_release_values()
+    test_inflight()
@@ -0,0 +1,81 @@
+import pymysql
+from spiderlib import *
+
+# 需要本地的MySQL或者MariaDB，服务器开启local_infile：SET GLOBAL local_infile = 1
+
+HOST, USER, PASSWORD, DATABASE = 'localhost', 'root', 'admin', 'test'
+
+
+def reset_table():
+    db = pymysql.connect(host=HOST, user=USER, password=PASSWORD, database=DATABASE, charset='utf8mb4')
+    with db.cursor() as c:
+        c.execute("DROP TABLE IF EXISTS bulk_data")
+        c.execute("CREATE TABLE bulk_data(title VARCHAR(255), content TEXT, pid VARCHAR(255)) DEFAULT CHARSET=utf8mb4")
+    db.commit()
+    return db
+
+
+def make_batch(rows: int):
+    batch = RecordBatch(size=rows)
+    batch.add('title', ['标题%d' % i for i in range(rows)])
+    batch.add('content', ['正文\t制表符\n换行\\反斜线%d' % i for i in range(rows)])
+    batch.broadcast('pid', None)
+    return batch
+
+
+def check(db, rows: int):
+    with db.cursor() as c:
+        c.execute("SELECT COUNT(*), SUM(pid IS NULL) FROM bulk_data")
+        count, nulls = c.fetchone()
+        c.execute("SELECT content FROM bulk_data WHERE title='标题1'")
+        content = c.fetchone()[0]
+    assert count == rows and nulls == rows, (count, nulls)
+    assert content == '正文\t制表符\n换行\\反斜线1', content
+
+
+def test_insert():
+    """
+    参数化的多行INSERT，缓冲区满了才写入
+    :return:
+    """
+    db = reset_table()
+    mysql = MySQLPipeline(host=HOST, user=USER, password=PASSWORD, database=DATABASE, table='bulk_data', batch=500)
+    for i in range(10):
+        mysql.save(make_batch(100))
+    mysql.close()
+    check(db, 1000)
+
+
+def test_bulk():
+    """
+    LOAD DATA LOCAL INFILE批量导入
+    :return:
+    """
+    db = reset_table()
+    mysql = MySQLPipeline(host=HOST, user=USER, password=PASSWORD, database=DATABASE, table='bulk_data', batch=100000, bulk=True)
+    for i in range(10):
+        mysql.save(make_batch(1000))
+    mysql.close()
+    check(db, 10000)
+
+
+def test_reconnect():
+    """
+    连接被服务器断开后，自动重连
+    :return:
+    """
+    db = reset_table()
+    mysql = MySQLPipeline(host=HOST, user=USER, password=PASSWORD, database=DATABASE, table='bulk_data', batch=1)
+    mysql.save(make_batch(10))
+    conn = mysql.pool.acquire()
+    with db.cursor() as c:
+        c.execute("KILL %d" % conn.thread_id())
+    mysql.pool.release(conn)
+    mysql.save(make_batch(10))
+    check(db, 20)
+
+
+if __name__ == '__main__':
+    test_insert()
+    test_bulk()
+    test_reconnect()
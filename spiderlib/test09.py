@@ -0,0 +1,110 @@
+import asyncio
+
+from spiderlib import *
+from spiderlib.stubs import ListPipeline
+
+# 用假的浏览器测试标签页池：标签页重复使用、同时渲染的数量、出错的标签页关闭后不会卡住等待的任务
+
+
+class StubTab:
+    def __init__(self, browser):
+        self.browser = browser
+        self.url = None
+
+    async def block(self, types):
+        self.blocked = types
+
+    async def goto(self, url, timeout):
+        self.browser.rendering += 1
+        self.browser.peak = max(self.browser.peak, self.browser.rendering)
+        try:
+            await asyncio.sleep(0.01)
+            if self.browser.fail:
+                raise asyncio.TimeoutError('打开 %s 超时' % url)
+        finally:
+            self.browser.rendering -= 1
+        self.url = url
+        return 200, {'content-type': 'text/html; charset=gbk'}
+
+    async def wait_for(self, selector, timeout):
+        pass
+
+    async def content(self):
+        return '<html><body><h1>{url}</h1></body></html>'.format(url=self.url)
+
+    async def close(self):
+        self.browser.closed += 1
+
+
+class StubBrowser(Browser):
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.made = 0
+        self.closed = 0
+        self.rendering = 0
+        self.peak = 0
+
+    async def new_tab(self):
+        self.made += 1
+        return StubTab(self)
+
+
+def crawl(browser, tabs: int, count: int, concurrency: int):
+    pipeline = ListPipeline()
+    spider = Spider('渲染', downloader=RenderDownloader(browser=browser, tabs=tabs), redup=MemoryRedup(), scheduler=MemoryScheduler(), pipeline=pipeline, retry=None)
+    spider.page(urls=['http://localhost/%d.html' % i for i in range(count)], expresses={'title': '//h1/text()'}, fields={'标题': 'title'})
+    spider.run(concurrency=concurrency)
+    return pipeline.rows
+
+
+def test_reuse():
+    """
+    标签页重复使用，同时渲染的数量不超过池的大小
+    :return:
+    """
+    browser = StubBrowser()
+    rows = crawl(browser, tabs=3, count=20, concurrency=8)
+    assert len(rows) == 20, rows
+    assert browser.made == 3, browser.made
+    assert browser.peak <= 3, browser.peak
+
+
+def test_broken():
+    """
+    所有标签页都出错时，等待的任务也能继续，不会一直卡住
+    :return:
+    """
+    async def render():
+        browser = StubBrowser(fail=True)
+        pool = TabPool(browser, size=2)
+
+        async def one(i):
+            tab = await pool.acquire()
+            try:
+                await tab.goto('http://localhost/%d.html' % i, 1)
+            except asyncio.TimeoutError:
+                await pool.release(tab, broken=True)
+                return False
+            await pool.release(tab)
+            return True
+        results = await asyncio.wait_for(asyncio.gather(*[one(i) for i in range(4)]), timeout=5)
+        assert results == [False] * 4, results
+        assert pool.created == 0 and browser.closed == 4, (pool.created, browser.closed)
+    asyncio.run(render())
+
+
+def test_broken_spider():
+    """
+    网站打不开时，爬虫正常结束
+    :return:
+    """
+    browser = StubBrowser(fail=True)
+    rows = crawl(browser, tabs=2, count=4, concurrency=4)
+    assert rows == [] and browser.made == 4, (rows, browser.made)
+
+
+if __name__ == '__main__':
+    test_reuse()
+    test_broken()
+    test_broken_spider()
+    print('ok')
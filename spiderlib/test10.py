@@ -0,0 +1,212 @@
+import threading
+import time
+
+import fakeredis
+from spiderlib import *
+from spiderlib.stubs import NullPipeline, StubDownloader
+
+# 用fakeredis测试RedisScheduler：多个进程共用队列、挂掉的进程的Page放回队列、心跳；RedisRedup本地缓存和集合名称
+
+
+def scheduler(server, ttl: int = 60):
+    """
+    连接到fakeredis的调度器，相当于一个进程
+    :param server:
+    :param ttl:
+    :return:
+    """
+    s = RedisScheduler(batch=2, ttl=ttl)
+    s.r = fakeredis.FakeRedis(server=server)
+    return s
+
+
+def template():
+    return Template(urls=['http://localhost/'], expresses={'title': '//h1/text()'}, next='', fields_tag='', fields={'标题': 'title'}, is_list=False)
+
+
+def fill(s, count: int):
+    for i in range(count):
+        s.put(Page(None, 'http://localhost/%d.html' % i, s.template))
+    s.flush()
+
+
+def test_claim_ack():
+    """
+    领取后在processing中，ack后删除
+    :return:
+    """
+    server = fakeredis.FakeServer()
+    t = template()
+    a, b = scheduler(server), scheduler(server)
+    a.bind(t)
+    b.bind(t)
+    fill(a, 3)
+    page = b.claim()
+    assert page.url == 'http://localhost/0.html'
+    # 单线程运行时每次只领取1个，其他的留给别的进程
+    assert b.r.llen(b.processing) == 1 and b.r.llen(b.pending) == 2
+    b.ack(page)
+    assert b.r.llen(b.processing) == 0
+    a.close()
+    b.close()
+
+
+def test_recover():
+    """
+    挂掉的进程领取的Page，被其他进程放回pending
+    :return:
+    """
+    server = fakeredis.FakeServer()
+    t = template()
+    a, b = scheduler(server), scheduler(server)
+    a.bind(t)
+    fill(a, 3)
+    a.claim()
+    # 进程a挂掉：不再心跳，心跳过期
+    a.stopped.set()
+    a.r.delete('{}:alive:{}'.format(a.name, a.worker))
+    b.bind(t)
+    assert b.r.llen(b.pending) == 3, b.r.llen(b.pending)
+    b.close()
+
+
+def test_heartbeat():
+    """
+    等待很长时间时，后台线程继续心跳，领取的Page不会被其他进程拿走
+    :return:
+    """
+    server = fakeredis.FakeServer()
+    t = template()
+    a, b = scheduler(server, ttl=3), scheduler(server, ttl=3)
+    a.bind(t)
+    fill(a, 2)
+    a.claim()
+    time.sleep(4)
+    assert b.recover() == 0
+    assert a.r.llen(a.processing) == 1
+    a.close()
+    assert not a.r.exists('{}:alive:{}'.format(a.name, a.worker))
+
+
+def test_stolen():
+    """
+    剩下的Page被其他进程领走时，head()返回None，爬虫正常结束
+    :return:
+    """
+    server = fakeredis.FakeServer()
+    t = template()
+    a, b = scheduler(server), scheduler(server)
+    a.bind(t)
+    b.bind(t)
+    fill(a, 4)
+    b.claim()
+    b.claim()
+    assert a.len() == 2
+    # a看到还有Page，领取之前被b领走了
+    b.claim()
+    b.claim()
+    assert a.head() is None
+    # b正常结束，领取了没处理的Page放回pending
+    b.close()
+    assert a.len() == 4, a.len()
+    a.close()
+
+    server = fakeredis.FakeServer()
+    c = scheduler(server)
+    thief = scheduler(server)
+
+    def steal():
+        # 其他进程领走剩下的Page，处理完成
+        for i in range(10):
+            page = thief.claim()
+            if page is not None:
+                thief.ack(page)
+    downloader = StubDownloader(on_fetch=steal)
+    spider = Spider('redis', downloader=downloader, redup=MemoryRedup(), scheduler=c, pipeline=NullPipeline())
+    spider.page(urls=['http://localhost/s%d.html' % i for i in range(6)], expresses={'title': '//h1/text()'}, fields={'标题': 'title'})
+    thief.bind(spider.template)
+    spider.run()
+    assert 0 < len(downloader.urls) < 6, downloader.urls
+    thief.close()
+
+
+class ListDownloader(Downloader):
+    """
+    列表页有20个链接，详情页下载慢一点，多个进程都能分到
+    """
+    def __init__(self, started=None):
+        self.started = started
+        self.urls = []
+
+    def fetch(self, spider, page, headers):
+        self.urls.append(page.url)
+        if page.url.endswith('list.html'):
+            body = ''.join('<a href="http://localhost/{}.html">{}</a>'.format(i, i) for i in range(20))
+        else:
+            if self.started:
+                self.started.set()
+            time.sleep(0.05)
+            body = '<h1>{}</h1>'.format(page.url)
+        return 200, {'Content-Type': 'text/html; charset=utf-8'}, body.encode('utf8')
+
+
+def worker(server, downloader, concurrency: int):
+    """
+    一个进程：共用fakeredis中的队列和去重集合
+    :param server:
+    :param downloader:
+    :param concurrency:
+    :return:
+    """
+    redup = RedisRedup()
+    redup.r = fakeredis.FakeRedis(server=server)
+    spider = Spider('worker', downloader=downloader, redup=redup, scheduler=scheduler(server), pipeline=NullPipeline())
+    spider.list(urls=['http://localhost/list.html'], expresses={'link': '//a/@href'}, next='link')
+    spider.page(expresses={'title': '//h1/text()'}, fields={'标题': 'title'})
+    thread = threading.Thread(target=spider.run, kwargs={'concurrency': concurrency})
+    thread.start()
+    return thread
+
+
+def test_workers():
+    """
+    两个进程共用队列：后启动的进程也能领取到Page，所有详情页只下载一次
+    :return:
+    """
+    for concurrency in (1, 4):
+        server = fakeredis.FakeServer()
+        started = threading.Event()
+        a, b = ListDownloader(started), ListDownloader()
+        ta = worker(server, a, concurrency)
+        started.wait(5)
+        tb = worker(server, b, concurrency)
+        ta.join()
+        tb.join()
+        pages = [url for url in a.urls + b.urls if not url.endswith('list.html')]
+        assert a.urls and len(b.urls) > 1, (a.urls, b.urls)
+        assert sorted(pages) == sorted(set(pages)) and len(pages) == 20, pages
+
+
+def test_redup_name():
+    """
+    本地缓存的url只属于初始化时的集合，判断其他集合时不使用
+    :return:
+    """
+    redup = RedisRedup(buffer=100)
+    redup.r = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+    redup.load('http://localhost/a.html')
+    assert redup.loaded_many(['http://localhost/a.html']) == [True]
+    assert redup.loaded_many(['http://localhost/a.html'], name='other') == [False]
+    redup.load('http://localhost/b.html', name='other')
+    assert redup.loaded_many(['http://localhost/b.html'], name='other') == [True]
+    assert redup.loaded_many(['http://localhost/b.html']) == [False]
+
+
+if __name__ == '__main__':
+    test_claim_ack()
+    test_recover()
+    test_heartbeat()
+    test_stolen()
+    test_workers()
+    test_redup_name()
+    print('ok')
@@ -0,0 +1,50 @@
+from spiderlib import *
+from spiderlib.stubs import ListPipeline, StubDownloader
+
+# 测试Hooker.before_save(...)中修改page.matrix：修改抓取的值、常量和pid，不影响page.values
+
+
+class EditHooker(Hooker):
+    def __init__(self):
+        self.values = None
+
+    def before_save(self, page):
+        page.matrix[1][0] = 'A'
+        page.matrix[2][2] = '改过的常量'
+        page.matrix.set('上级', 0, 'pid0')
+        self.values = page.values
+
+
+def test_set():
+    """
+    修改列、Broadcast展开
+    :return:
+    """
+    batch = RecordBatch(size=3)
+    values = ['a', 'b', 'c']
+    batch.add('name', values)
+    batch.broadcast('tag', 'x')
+    batch[2][1] = 'y'
+    batch.set('name', 0, 'A')
+    assert [list(row) for row in batch.rows()] == [['A', 'x'], ['b', 'y'], ['c', 'x']]
+    assert values == ['a', 'b', 'c']
+
+
+def test_hooker():
+    """
+    钩子函数修改的值写入管道
+    :return:
+    """
+    hooker = EditHooker()
+    pipeline = ListPipeline()
+    spider = Spider('钩子', downloader=StubDownloader('<ul><li>a</li><li>b</li><li>c</li></ul>'), redup=MemoryRedup(), scheduler=MemoryScheduler(), pipeline=pipeline, release_values=False)
+    spider.list(urls=['http://localhost/'], expresses={'item': '//li/text()'}, fields={'名称': 'item', '上级': 'pid', '来源': '常量'}, hooker=hooker)
+    spider.run()
+    assert pipeline.rows == [['A', 'pid0', '常量'], ['b', None, '改过的常量'], ['c', None, '常量']], pipeline.rows
+    assert hooker.values['item'] == ['a', 'b', 'c'], hooker.values
+
+
+if __name__ == '__main__':
+    test_set()
+    test_hooker()
+    print('ok')
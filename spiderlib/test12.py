@@ -0,0 +1,45 @@
+import os
+import tempfile
+
+from spiderlib import *
+
+# 测试DiskScheduler使用固定的文件时，close()后重新打开，没有抓取完的Page都还在，顺序不变
+
+
+def template():
+    return Template(urls=['http://localhost/'], expresses={'title': '//h1/text()'}, next='', fields_tag='', fields={}, is_list=False)
+
+
+def open_scheduler(path, t):
+    s = DiskScheduler(maxsize=3, path=path, batch=2)
+    s.bind(t)
+    return s
+
+
+def test_restart():
+    """
+    内存中的Page、领取了没有ack(...)的Page，close()时写回磁盘
+    :return:
+    """
+    path = tempfile.mktemp(prefix='spiderlib_', suffix='.db')
+    t = template()
+    s = open_scheduler(path, t)
+    for i in range(9):
+        s.put(Page(None, 'http://localhost/%d.html' % i, t))
+    s.head()
+    s.remove_head()
+    s.claim()
+    s.ack(s.claim())
+    s.close()
+
+    s = open_scheduler(path, t)
+    assert s.len() == 7, s.len()
+    urls = [s.remove_head().url for i in range(7)]
+    assert urls == ['http://localhost/%d.html' % i for i in [1] + list(range(3, 9))], urls
+    s.close()
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    test_restart()
+    print('ok')
@@ -0,0 +1,94 @@
+from spiderlib import *
+from spiderlib.stubs import ListPipeline
+
+# 测试Downloader.read(...)：每个响应只判断一次是否增量解析，不支持增量解析时不会每一块都重新判断编码；不是utf-8的页面
+
+
+class CountParser(HtmlParser):
+    def __init__(self, incremental: bool):
+        super().__init__(incremental=incremental)
+        self.feeders = 0
+
+    def feeder(self, page, encoding):
+        self.feeders += 1
+        return super().feeder(page, encoding)
+
+
+class ChunkDownloader(Downloader):
+    """
+    不访问网络，内容按1KB一块读取
+    """
+    def __init__(self):
+        self.charsets = 0
+
+    def charset(self, headers, body):
+        self.charsets += 1
+        return Downloader.charset(headers, body)
+
+    def fetch(self, spider, page, headers):
+        headers = {'Content-Type': 'text/html'}
+        body = b'<html><body><h1>title</h1><div id="c">' + b'<p>text</p>' * 10000 + b'</div><div id="end"></div></body></html>'
+        return 200, headers, self.read(spider, page, headers, (body[i:i + 1024] for i in range(0, len(body), 1024)))
+
+
+def crawl(incremental: bool):
+    downloader, parser, pipeline = ChunkDownloader(), CountParser(incremental), ListPipeline()
+    spider = Spider('增量', downloader=downloader, redup=MemoryRedup(), scheduler=MemoryScheduler(), pipeline=pipeline, parser=parser)
+    spider.page(urls=['http://localhost/'], expresses={'title': '//h1/text()'}, fields={'标题': 'title'}, until="//div[@id='c']")
+    spider.run()
+    return downloader.charsets, parser.feeders, pipeline.rows
+
+
+def test_full():
+    """
+    不增量解析，读取全部内容后判断一次编码
+    :return:
+    """
+    assert crawl(False) == (1, 0, [['title']])
+
+
+def test_incremental():
+    """
+    增量解析，只创建一次HtmlFeeder
+    :return:
+    """
+    assert crawl(True) == (2, 1, [['title']])
+
+
+class CharsetDownloader(Downloader):
+    """
+    不访问网络，返回指定编码的页面，编码写在响应头或者meta标签中
+    """
+    def __init__(self, codec: str, content_type: str, meta: str = ''):
+        self.codec = codec
+        self.content_type = content_type
+        self.meta = meta
+
+    def fetch(self, spider, page, headers):
+        headers = {'Content-Type': self.content_type}
+        text = '<html><head>{}</head><body><h1>日本語のタイトル</h1><div>{}</div></body></html>'.format(self.meta, '<p>本文</p>' * 1000)
+        body = text.encode(self.codec)
+        return 200, headers, self.read(spider, page, headers, (body[i:i + 1024] for i in range(0, len(body), 1024)))
+
+
+def test_charset():
+    """
+    不是utf-8的页面：lxml认识的编码直接解析，python的编码名称在python中解码
+    :return:
+    """
+    cases = [('euc_jp', 'text/html; charset=EUC-JP', ''), ('shift_jis', 'text/html', '<meta charset="Shift_JIS">'),
+             ('euc_jp', 'text/html; charset=euc_jp', ''), ('gbk', 'text/html', '<meta http-equiv="Content-Type" content="text/html; charset=gbk">')]
+    for codec, content_type, meta in cases:
+        for incremental in (False, True):
+            pipeline = ListPipeline()
+            spider = Spider('编码', downloader=CharsetDownloader(codec, content_type, meta), redup=MemoryRedup(), scheduler=MemoryScheduler(), pipeline=pipeline, parser=HtmlParser(incremental))
+            spider.page(urls=['http://localhost/'], expresses={'title': '//h1/text()'}, fields={'标题': 'title'})
+            spider.run()
+            assert pipeline.rows == [['日本語のタイトル']], (codec, content_type, incremental, pipeline.rows)
+
+
+if __name__ == '__main__':
+    test_full()
+    test_incremental()
+    test_charset()
+    print('ok')
@@ -0,0 +1,72 @@
+from spiderlib import *
+from spiderlib.stubs import ListPipeline, StubDownloader
+
+# 测试下载失败的页面：不是网络错误的异常（解码、解析、读取中断）不重试，也不加入去重，下次运行还会抓取；保存后加入去重报错时页面也确认完成
+
+
+class BrokenDownloader(Downloader):
+    """
+    不访问网络，读取内容时报错
+    """
+    def __init__(self):
+        self.urls = []
+
+    def fetch(self, spider, page, headers):
+        self.urls.append(page.url)
+        raise ValueError('读取中断')
+
+
+def test_error_not_loaded():
+    """
+    报错的页面记为error，不重试，不加入去重
+    :return:
+    """
+    for concurrency in (1, 4):
+        downloader, redup, pipeline = BrokenDownloader(), MemoryRedup(), ListPipeline()
+        spider = Spider('报错', downloader=downloader, redup=redup, scheduler=MemoryScheduler(), pipeline=pipeline, retry=RetryPolicy(base=0.01))
+        spider.page(urls=['http://localhost/1.html'], expresses={'title': '//h1/text()'}, fields={'标题': 'title'})
+        spider.run(concurrency=concurrency)
+        assert downloader.urls == ['http://localhost/1.html'], downloader.urls
+        assert pipeline.rows == [] and not redup.loaded('http://localhost/1.html')
+
+
+class BrokenRedup(MemoryRedup):
+    """
+    加入去重时报错，相当于连接Redis失败
+    """
+    def load(self, url, name=None):
+        raise ConnectionError('连接失败')
+
+
+class BrokenScheduler(MemoryScheduler):
+    def __init__(self):
+        super().__init__()
+        self.acked = []
+
+    def ack(self, page):
+        self.acked.append(page.url)
+        super().ack(page)
+
+
+def test_after_save_error():
+    """
+    保存后的处理报错时，页面仍然确认完成，不留在inflight中；并发运行时继续处理其他页面
+    :return:
+    """
+    urls = ['http://localhost/%d.html' % i for i in range(3)]
+    for concurrency in (1, 4):
+        scheduler, pipeline = BrokenScheduler(), ListPipeline()
+        spider = Spider('报错', downloader=StubDownloader(), redup=BrokenRedup(), scheduler=scheduler, pipeline=pipeline)
+        spider.page(urls=urls, expresses={'title': '//h1/text()'}, fields={'标题': 'title'})
+        spider.run(concurrency=concurrency)
+        if concurrency > 1:
+            assert sorted(scheduler.acked) == urls and sorted(pipeline.rows) == [[url] for url in urls], (scheduler.acked, pipeline.rows)
+            assert not spider.inflight and scheduler.len() == 0
+        else:
+            # 单线程运行时报错结束运行，报错的页面已经从队列中删除
+            assert scheduler.len() == 2, scheduler.len()
+
+if __name__ == '__main__':
+    test_error_not_loaded()
+    test_after_save_error()
+    print('ok')
@@ -0,0 +1,73 @@
+import os
+import tempfile
+
+from spiderlib import *
+
+# 测试布隆过滤器：误判率、同一批重复的url、保存到文件后重新读取
+
+
+def urls(start: int, count: int) -> list:
+    return ['http://localhost/{}.html'.format(i) for i in range(start, start + count)]
+
+
+def false_positive(redup, loaded: int) -> float:
+    """
+    没有加入过的url被误判成重复的比例
+    :param redup:
+    :param loaded: 已经加入的url数量
+    :return:
+    """
+    flags = redup.loaded_many(urls(loaded, 20000))
+    return sum(flags) / len(flags)
+
+
+def test_bloom():
+    """
+    加入的url都判断为重复，误判率接近error_rate
+    :return:
+    """
+    redup = BloomRedup(capacity=10000, error_rate=0.01)
+    redup.load_many(urls(0, 10000))
+    assert all(redup.loaded_many(urls(0, 10000)))
+    rate = false_positive(redup, 10000)
+    print('BloomRedup误判率{:.4f}'.format(rate))
+    assert rate < 0.02, rate
+
+
+def test_scalable():
+    """
+    超过容量后自动扩展，总误判率不超过error_rate；同一批中重复的url只计数一次
+    :return:
+    """
+    redup = ScalableBloomRedup(capacity=1000, error_rate=0.01)
+    redup.load_many(['http://localhost/a.html'] * 1000)
+    assert len(redup.filters) == 1 and redup.filters[0].count == 1
+    redup.load_many(urls(0, 10000))
+    assert len(redup.filters) > 1
+    assert all(redup.loaded_many(urls(0, 10000)))
+    rate = false_positive(redup, 10000)
+    print('ScalableBloomRedup误判率{:.4f} 过滤器{}个'.format(rate, len(redup.filters)))
+    assert rate < 0.02, rate
+
+
+def test_dump():
+    """
+    设置了path时，flush()保存到文件，重新创建时读取
+    :return:
+    """
+    for cls in (BloomRedup, ScalableBloomRedup):
+        path = tempfile.mktemp(prefix='spiderlib_', suffix='.npz')
+        redup = cls(capacity=1000, error_rate=0.01, path=path)
+        redup.load_many(urls(0, 3000 if cls is ScalableBloomRedup else 1000))
+        redup.flush()
+        again = cls(capacity=1000, error_rate=0.01, path=path)
+        assert all(again.loaded_many(urls(0, 1000))), cls
+        assert false_positive(again, 3000) < 0.02, cls
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    test_bloom()
+    test_scalable()
+    test_dump()
+    print('ok')
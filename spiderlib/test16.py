@@ -0,0 +1,99 @@
+import asyncio
+import threading
+import time
+
+import h2.config
+import h2.connection
+import h2.events
+from spiderlib import *
+from spiderlib.stubs import ListPipeline, NullLogger
+
+# 本地h2c服务器测试HttpxDownloader：HTTP/2多路复用，所有请求共用一个连接；对比并发下载的耗时
+
+PORT = 8767
+DELAY = 0.05    # 服务器处理每个请求的秒数
+
+
+class H2Server:
+    """
+    不加密的HTTP/2服务器(h2c)，列表页有20个链接，每个请求等待DELAY秒后返回
+    """
+    def __init__(self, port: int = PORT):
+        self.port = port
+        self.connections = 0
+        self.requests = 0
+        self.ready = threading.Event()
+
+    def body(self, path: str) -> bytes:
+        if path == '/index.html':
+            links = ''.join('<a href="http://127.0.0.1:{}/{}.html">{}</a>'.format(self.port, i, i) for i in range(20))
+            return '<html><body>{}</body></html>'.format(links).encode('utf8')
+        return '<html><body><h1>标题{}</h1></body></html>'.format(path.strip('/').split('.')[0]).encode('utf8')
+
+    async def respond(self, conn, writer, stream_id: int, path: str):
+        await asyncio.sleep(DELAY)
+        body = self.body(path)
+        conn.send_headers(stream_id, [(':status', '200'), ('content-type', 'text/html; charset=utf-8'), ('content-length', str(len(body)))])
+        conn.send_data(stream_id, body, end_stream=True)
+        writer.write(conn.data_to_send())
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False))
+        conn.initiate_connection()
+        writer.write(conn.data_to_send())
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    self.requests += 1
+                    asyncio.ensure_future(self.respond(conn, writer, event.stream_id, dict(event.headers)[b':path'].decode()))
+            writer.write(conn.data_to_send())
+        writer.close()
+
+    def run(self):
+        async def serve():
+            server = await asyncio.start_server(self.handle, '127.0.0.1', self.port)
+            self.ready.set()
+            async with server:
+                await server.serve_forever()
+        asyncio.run(serve())
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        self.ready.wait(5)
+        return self
+
+
+def crawl(concurrency: int):
+    pipeline = ListPipeline()
+    downloader = HttpxDownloader(http1=False)
+    spider = Spider('h2c', downloader=downloader, redup=MemoryRedup(), scheduler=MemoryScheduler(), pipeline=pipeline, logger=NullLogger())
+    spider.list(urls=['http://127.0.0.1:{}/index.html'.format(PORT)], expresses={'link': '//a/@href'}, next='link')
+    spider.page(expresses={'title': '//h1/text()'}, fields={'标题': 'title'})
+    start = time.time()
+    spider.run(concurrency=concurrency)
+    return pipeline.rows, time.time() - start
+
+
+def test_h2c():
+    """
+    HTTP/2下载全部页面，并发下载时只用一个连接
+    :return:
+    """
+    server = H2Server().start()
+    for concurrency in (1, 8):
+        server.connections = server.requests = 0
+        rows, seconds = crawl(concurrency)
+        print('并发{} 页面{} 连接{} 耗时{:.2f}秒'.format(concurrency, server.requests, server.connections, seconds))
+        assert sorted(rows) == sorted([['标题%d' % i] for i in range(20)]), rows
+        assert server.requests == 21 and server.connections == 1, (server.requests, server.connections)
+        if concurrency > 1:
+            assert seconds < 21 * DELAY, seconds
+
+
+if __name__ == '__main__':
+    test_h2c()
+    print('ok')
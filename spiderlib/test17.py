@@ -0,0 +1,85 @@
+import time
+
+from spiderlib import *
+from spiderlib.stubs import ListPipeline
+
+# 测试HostScheduler：多个host轮询、每个host的队列长度；host熔断暂停时等待恢复，不会马上把页面交给熔断器拒绝
+
+
+def page(url: str) -> Page:
+    return Page(None, url, None)
+
+
+def test_round_robin():
+    """
+    多个host轮流取出，同一个host按加入的顺序；队列空的host不再轮到
+    :return:
+    """
+    s = HostScheduler()
+    for url in ('http://a.com/1.html', 'http://a.com/2.html', 'http://a.com/3.html', 'http://B.com/1.html', 'http://c.com/1.html', 'http://b.com/2.html'):
+        s.put(page(url))
+    assert s.len() == 6
+    assert s.stats() == {'a.com': 3, 'b.com': 2, 'c.com': 1}, s.stats()
+    urls = []
+    while s.len():
+        assert s.head() is s.head()
+        urls.append(s.remove_head().url)
+    assert urls == ['http://a.com/1.html', 'http://B.com/1.html', 'http://c.com/1.html', 'http://a.com/2.html', 'http://b.com/2.html', 'http://a.com/3.html'], urls
+    assert s.head() is None and s.claim() is None and s.stats() == {}
+
+
+def test_all_parked():
+    """
+    所有host都暂停时，轮到最早恢复的host，队首的not_before推迟到恢复的时间
+    :return:
+    """
+    s = HostScheduler()
+    for url in ('http://a.com/1.html', 'http://b.com/1.html'):
+        s.put(page(url))
+    now = time.time()
+    s.park('a.com', now + 20)
+    s.park('b.com', now + 10)
+    ele = s.head()
+    assert ele.url == 'http://b.com/1.html' and ele.not_before == now + 10, (ele.url, ele.not_before)
+    # 有没暂停的host时，不推迟
+    s.put(page('http://c.com/1.html'))
+    ele = s.head()
+    assert ele.url == 'http://c.com/1.html' and ele.not_before == 0.0
+
+
+class FlakyDownloader(Downloader):
+    """
+    不访问网络，前failures次返回503，连续失败2次就熔断
+    """
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.urls = []
+        self.breaker = CircuitBreaker(threshold=2, reset=0.3)
+
+    def fetch(self, spider, page, headers):
+        self.urls.append(page.url)
+        if len(self.urls) <= self.failures:
+            return 503, {}, None
+        return 200, {'Content-Type': 'text/html; charset=utf-8'}, '<h1>{}</h1>'.format(page.url).encode('utf8')
+
+
+def test_single_host_parked():
+    """
+    只有一个host熔断时，等待恢复后再下载，新的页面不会被熔断器拒绝、用掉等待次数
+    :return:
+    """
+    urls = ['http://localhost/%d.html' % i for i in range(3)]
+    downloader, pipeline = FlakyDownloader(3), ListPipeline()
+    spider = Spider('熔断', downloader=downloader, redup=MemoryRedup(), scheduler=HostScheduler(), pipeline=pipeline,
+                    retry=RetryPolicy(base=0.01, max_parks=1))
+    spider.page(urls=urls, expresses={'title': '//h1/text()'}, fields={'标题': 'title'})
+    spider.run()
+    assert sorted(pipeline.rows) == [[url] for url in urls], pipeline.rows
+    assert len(downloader.urls) == 6, downloader.urls
+
+
+if __name__ == '__main__':
+    test_round_robin()
+    test_all_parked()
+    test_single_host_parked()
+    print('ok')
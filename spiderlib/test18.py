@@ -0,0 +1,56 @@
+import threading
+import time
+
+from spiderlib import *
+
+# 测试MemoryContentRedup：内容相近的页面判断为重复；多个线程同时判断同样的内容，只有一个不重复
+
+TEXT = '<html><body><h1>标题</h1><p>{}</p></body></html>'.format('这是一篇很长的文章，内容相同的页面有多个url。' * 50)
+
+
+class SlowContentRedup(MemoryContentRedup):
+    """
+    查找候选指纹比较慢，多个线程更容易同时判断
+    """
+    def candidates(self, fp):
+        ret = super().candidates(fp)
+        time.sleep(0.01)
+        return ret
+
+
+def test_duplicated():
+    """
+    完全相同、只差几个字的内容都是重复，不同的内容不重复
+    :return:
+    """
+    redup = MemoryContentRedup()
+    assert not redup.duplicated(TEXT)
+    assert redup.duplicated(TEXT.encode('utf8'), 'utf8')
+    assert redup.duplicated(TEXT.replace('<h1>标题</h1>', '<h1>标题（打印版）</h1>'))
+    assert not redup.duplicated('<html><body><p>{}</p></body></html>'.format('另外一篇文章，说的是别的事情。' * 50))
+
+
+def test_threads():
+    """
+    多个线程同时判断同样的内容，只有一个线程返回不重复
+    :return:
+    """
+    redup = SlowContentRedup()
+    barrier = threading.Barrier(8)
+    results = []
+
+    def check():
+        barrier.wait()
+        results.append(redup.duplicated(TEXT))
+    threads = [threading.Thread(target=check) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results.count(False) == 1, results
+
+
+if __name__ == '__main__':
+    test_duplicated()
+    test_threads()
+    print('ok')
@@ -0,0 +1,54 @@
+from spiderlib import *
+
+# 测试UrlCanonicalizer：写法不同、实际相同的url规范化后相同；MemoryRedup使用规范化后的url和摘要判断重复
+
+
+def test_canonicalize():
+    """
+    scheme和host转小写，去掉默认端口、#后面的部分、跟踪参数，参数排序
+    :return:
+    """
+    c = UrlCanonicalizer()
+    assert c.canonicalize('http://x/a?b=1&c=2') == 'http://x/a?b=1&c=2'
+    assert c.canonicalize('http://X/a?c=2&b=1') == 'http://x/a?b=1&c=2'
+    assert c.canonicalize('http://x/a#frag') == 'http://x/a'
+    assert c.canonicalize('HTTP://Example.COM:80/Path') == 'http://example.com/Path'
+    assert c.canonicalize('https://example.com:443') == 'https://example.com/'
+    assert c.canonicalize('https://example.com:8443/') == 'https://example.com:8443/'
+    assert c.canonicalize('http://user@[::1]:80/') == 'http://user@[::1]/'
+    assert c.canonicalize('http://x/a?utm_source=mail&id=1&gclid=abc&utm_medium=x') == 'http://x/a?id=1'
+
+
+def test_options():
+    """
+    不去掉#后面的部分、不排序、自定义去掉的参数
+    :return:
+    """
+    c = UrlCanonicalizer(strip_fragment=False, sort_query=False, remove_params=('sid', 'ref_*'))
+    assert c.canonicalize('http://x/a?c=2&b=1#frag') == 'http://x/a?c=2&b=1#frag'
+    assert c.canonicalize('http://x/a?sid=9&ref_src=t&utm_source=mail') == 'http://x/a?utm_source=mail'
+
+
+def test_redup():
+    """
+    MemoryRedup规范化后判断重复；保存摘要时key是固定长度的bytes
+    :return:
+    """
+    for bits in (0, 64, 128):
+        redup = MemoryRedup(canonicalizer=UrlCanonicalizer(), digest_bits=bits)
+        redup.load('http://x/a?b=1&c=2')
+        assert redup.loaded('http://X/a?c=2&b=1#frag')
+        assert not redup.loaded('http://x/a')
+        if bits:
+            assert len(redup.key('http://x/a')) == bits // 8
+    # 不规范化时，写法不同就不重复
+    redup = MemoryRedup()
+    redup.load('http://x/a?b=1&c=2')
+    assert not redup.loaded('http://X/a?c=2&b=1')
+
+
+if __name__ == '__main__':
+    test_canonicalize()
+    test_options()
+    test_redup()
+    print('ok')
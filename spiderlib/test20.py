@@ -0,0 +1,68 @@
+import time
+from email.utils import format_datetime
+from datetime import datetime, timezone
+
+from spiderlib import *
+
+# 测试AutoThrottle：成功时窗口慢慢增加，429、5xx、出错时减半、间隔加倍；遵守Retry-After
+
+
+def request(t, host: str, latency: float, status, retry_after=None) -> dict:
+    """
+    等到可以请求，然后按结果调整
+    :return: 调整后这个host的状态
+    """
+    t.wait(host)
+    t.release(host, latency, status, retry_after)
+    return t.stats()[host]
+
+
+def test_aimd():
+    """
+    成功时窗口加1/窗口、间隔趋向响应时间；429和出错时窗口减半、间隔加倍
+    :return:
+    """
+    t = AutoThrottle(start_delay=0.01, max_window=4)
+    assert t.reserve('a') == 0
+    assert t.reserve('a') > 0, '窗口是1，同时只能请求一个'
+    t.release('a', 0.02, 200)
+    st = t.stats()['a']
+    assert st['window'] == 2.0 and abs(st['delay'] - 0.015) < 1e-9 and st['inflight'] == 0, st
+    st = request(t, 'a', 0.02, 200)
+    assert st['window'] == 2.5 and abs(st['delay'] - 0.0175) < 1e-9, st
+    st = request(t, 'a', 0.02, 429)
+    assert st['window'] == 1.25 and abs(st['delay'] - 0.035) < 1e-9, st
+    st = request(t, 'a', 0.02, None)
+    assert st['window'] == 1.0 and abs(st['delay'] - 0.07) < 1e-9, st
+    # 错误页面响应很快，不能加快
+    st = request(t, 'a', 0.0, 404)
+    assert st['window'] == 2.0 and abs(st['delay'] - 0.07) < 1e-9, st
+    # 窗口不超过max_window；其他host不受影响
+    for i in range(20):
+        st = request(t, 'a', 0.0, 200)
+    assert st['window'] == 4.0 and st['delay'] < 0.001, st
+    assert t.reserve('b') == 0 and t.stats()['b']['window'] == 1.0
+
+
+def test_retry_after():
+    """
+    Retry-After可以是秒数或者时间，之前不再请求这个host
+    :return:
+    """
+    assert AutoThrottle.retry_after('120') == 120.0
+    assert AutoThrottle.retry_after(None) == 0 and AutoThrottle.retry_after('soon') == 0
+    date = format_datetime(datetime.fromtimestamp(time.time() + 30, timezone.utc), usegmt=True)
+    assert 28 < AutoThrottle.retry_after(date) <= 30, date
+    past = format_datetime(datetime.fromtimestamp(time.time() - 30, timezone.utc), usegmt=True)
+    assert AutoThrottle.retry_after(past) == 0
+    t = AutoThrottle(start_delay=0.01)
+    assert t.reserve('a') == 0
+    t.release('a', 0.01, 503, '2')
+    assert 1.9 < t.reserve('a') <= 2
+    assert t.reserve('b') == 0
+
+
+if __name__ == '__main__':
+    test_aimd()
+    test_retry_after()
+    print('ok')
@@ -0,0 +1,65 @@
+import time
+
+from spiderlib import *
+
+# 测试CircuitBreaker：连续失败后打开、reset秒后放一个请求试探、试探成功关闭；RetryPolicy的重试次数和等待时间
+
+
+def test_breaker():
+    """
+    打开、半开、关闭
+    :return:
+    """
+    b = CircuitBreaker(threshold=2, reset=0.2)
+    assert b.allow('a') and b.until('a') == 0.0
+    b.record('a', False)
+    assert b.allow('a'), '没到threshold次不打开'
+    b.record('a', True)
+    b.record('a', False)
+    assert b.allow('a'), '成功后重新计数'
+    b.record('a', False)
+    # 打开：reset秒内拒绝，其他host不受影响
+    assert not b.allow('a') and b.allow('b')
+    assert time.time() < b.until('a') <= time.time() + 0.2
+    time.sleep(0.25)
+    # 半开：只放一个请求试探
+    assert b.allow('a')
+    assert not b.allow('a')
+    assert b.until('a') >= time.time() + 0.01
+    # 试探失败，继续打开
+    b.record('a', False)
+    assert not b.allow('a')
+    time.sleep(0.25)
+    assert b.allow('a')
+    # 试探成功，关闭
+    b.record('a', True)
+    assert b.allow('a') and b.allow('a') and b.until('a') == 0.0
+
+
+def test_retry_policy():
+    """
+    重试次数、熔断等待次数分别计算；等待时间指数增长，不超过cap，抖动在一半到全部之间
+    :return:
+    """
+    r = RetryPolicy(max_attempts=2, base=1.0, cap=5.0, jitter=False, max_parks=1)
+    page = Page(None, 'http://localhost/', None)
+    page.error, page.attempts = '5xx', 2
+    assert r.retryable(page)
+    page.attempts = 3
+    assert not r.retryable(page)
+    page.error, page.parks = 'circuit', 1
+    assert r.retryable(page), '熔断不算在max_attempts中'
+    page.parks = 2
+    assert not r.retryable(page)
+    page.error, page.attempts = 'error', 1
+    assert not r.retryable(page), '不是网络错误不重试'
+    assert [r.backoff(i) for i in range(1, 6)] == [1.0, 2.0, 4.0, 5.0, 5.0]
+    r = RetryPolicy(base=1.0, cap=5.0)
+    for i in range(100):
+        assert 2.0 <= r.backoff(3) <= 4.0
+
+
+if __name__ == '__main__':
+    test_breaker()
+    test_retry_policy()
+    print('ok')
@@ -0,0 +1,82 @@
+import socket
+import time
+
+from spiderlib import *
+
+# 测试DnsCache：命中、未命中、过期后重新解析；解析失败不缓存；替换socket.getaddrinfo
+
+
+class Resolver:
+    """
+    不访问网络的解析器，记录解析次数
+    """
+    def __init__(self):
+        self.hosts = []
+
+    def __call__(self, host, port, family=0, type=0, proto=0, flags=0):
+        self.hosts.append(host)
+        if host == 'bad.example':
+            raise socket.gaierror('解析失败')
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', port))]
+
+
+def test_ttl():
+    """
+    ttl内命中缓存，过期后重新解析
+    :return:
+    """
+    cache, resolver = DnsCache(ttl=0.2), Resolver()
+    cache.original = resolver
+    ret = cache.getaddrinfo('a.example', 80)
+    assert cache.getaddrinfo('a.example', 80) == ret
+    cache.getaddrinfo('a.example', 443)
+    assert resolver.hosts == ['a.example', 'a.example']
+    assert cache.stats() == {'hits': 1, 'misses': 2, 'size': 2}, cache.stats()
+    time.sleep(0.25)
+    cache.getaddrinfo('a.example', 80)
+    assert len(resolver.hosts) == 3 and cache.stats()['misses'] == 3
+
+
+def test_failure():
+    """
+    解析失败抛出异常，不缓存；prefetch忽略解析失败
+    :return:
+    """
+    cache, resolver = DnsCache(), Resolver()
+    cache.original = resolver
+    for i in range(2):
+        try:
+            cache.getaddrinfo('bad.example', 80)
+            assert False
+        except socket.gaierror:
+            pass
+    assert resolver.hosts == ['bad.example'] * 2 and cache.stats()['size'] == 0
+    cache.prefetch(['http://bad.example/', 'https://b.example/1.html', 'not a url'])
+    cache.getaddrinfo('b.example', 443, socket.AF_UNSPEC, socket.SOCK_STREAM)
+    assert resolver.hosts.count('b.example') == 1 and cache.stats()['hits'] == 1
+
+
+def test_install():
+    """
+    install后socket.getaddrinfo经过缓存，重复install没有影响，uninstall后还原
+    :return:
+    """
+    original = socket.getaddrinfo
+    cache = DnsCache()
+    cache.install()
+    cache.install()
+    try:
+        assert socket.getaddrinfo == cache.getaddrinfo and cache.original is original
+        socket.getaddrinfo('localhost', 80)
+        socket.getaddrinfo('localhost', 80)
+        assert cache.stats()['hits'] == 1
+    finally:
+        cache.uninstall()
+    assert socket.getaddrinfo is original and cache.original is None
+
+
+if __name__ == '__main__':
+    test_ttl()
+    test_failure()
+    test_install()
+    print('ok')